@@ -0,0 +1,227 @@
+"""
+Market analytics: price per m² by segment and lot absorption.
+
+Aggregates are kept per segment and updated on every write, so a
+dashboard query only merges segments and never scans listings:
+
+- price per m² per (quartier, type, transaction): count, sum and sum of
+  squares (exact mean and standard deviation) and a quantile sketch;
+- lots per location: how many were offered (`lots`) and are still
+  available (`dispo`), hence sold and the absorption rate.
+
+Coarser groupings (by quartier only, by region, ...) are merges of the
+finer segments. The sketch is a log-bucketed histogram: every quantile is
+within SKETCH_ACCURACY relative error, and unlike a sample or t-digest it
+supports removals exactly, which updates and deletes need.
+"""
+
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import ChangeListener
+from quartiers import region_of
+
+# Relative error of sketch quantiles
+SKETCH_ACCURACY = 0.01
+_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+# Dimensions of a price-per-m² segment, and what they may be grouped by
+SEGMENT_FIELDS = ("nb", "ty", "tr")
+GROUP_FIELDS = ("nb", "rg", "ty", "tr")
+
+
+class QuantileSketch:
+    """Counts of values per logarithmic bucket; mergeable and supports removal"""
+
+    __slots__ = ("counts", "n")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.n = 0
+
+    @staticmethod
+    def bucket(value: float) -> int:
+        return math.ceil(math.log(value) / _LOG_GAMMA)
+
+    def add(self, value: float, count: int = 1):
+        b = self.bucket(value)
+        self.counts[b] = self.counts.get(b, 0) + count
+        self.n += count
+
+    def remove(self, value: float):
+        b = self.bucket(value)
+        left = self.counts.get(b, 0) - 1
+        if left < 0:
+            return
+        if left:
+            self.counts[b] = left
+        else:
+            del self.counts[b]
+        self.n -= 1
+
+    def merge(self, other: "QuantileSketch"):
+        for b, count in other.counts.items():
+            self.counts[b] = self.counts.get(b, 0) + count
+        self.n += other.n
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        if not self.n:
+            return [None for _ in qs]
+        buckets = sorted(self.counts.items())
+        out = []
+        i, seen = 0, buckets[0][1]
+        for q in sorted(qs):
+            rank = q * (self.n - 1)
+            while seen <= rank:
+                i += 1
+                seen += buckets[i][1]
+            # Midpoint of the bucket, in relative terms
+            out.append(2 * _GAMMA ** buckets[i][0] / (_GAMMA + 1))
+        return out
+
+
+class Segment:
+    """Moments and quantile sketch of the values in one segment"""
+
+    __slots__ = ("n", "total", "total_sq", "sketch")
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.total_sq = 0
+        self.sketch = QuantileSketch()
+
+    def add(self, value: int):
+        self.n += 1
+        self.total += value
+        self.total_sq += value * value
+        self.sketch.add(value)
+
+    def remove(self, value: int):
+        self.n -= 1
+        self.total -= value
+        self.total_sq -= value * value
+        self.sketch.remove(value)
+
+    def merge(self, other: "Segment"):
+        self.n += other.n
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.sketch.merge(other.sketch)
+
+    def summary(self) -> dict:
+        if not self.n:
+            return {"count": 0, "mean": None, "std": None}
+        mean = self.total / self.n
+        # Values are whole FCFA, so the sums are exact integers
+        var = (self.total_sq - self.total * self.total / self.n) / (self.n - 1) if self.n > 1 else 0.0
+        out = {"count": self.n, "mean": round(mean), "std": round(math.sqrt(max(var, 0.0)))}
+        for q, v in zip(QUANTILES, self.sketch.quantiles(QUANTILES)):
+            out[f"p{round(q * 100)}"] = round(v)
+        return out
+
+
+def price_per_m2(doc: dict) -> Optional[int]:
+    pr, su = doc.get("pr") or 0, doc.get("su") or 0
+    if pr <= 0 or su <= 0:
+        return None
+    return max(1, round(pr / su))
+
+
+class PropertyAnalytics(ChangeListener):
+    """Price per m² aggregated per (nb, ty, tr)"""
+
+    def __init__(self):
+        self.rebuild([])
+
+    def rebuild(self, docs: List[dict]):
+        self.segments: Dict[Tuple[str, ...], Segment] = {}
+        self.rows: Dict[str, Tuple[Tuple[str, ...], int]] = {}
+        for doc in docs:
+            self.add(doc)
+
+    def add(self, doc: dict):
+        self.remove(doc["id"])
+        value = price_per_m2(doc)
+        if value is None:
+            return
+        key = tuple(doc.get(f) or "" for f in SEGMENT_FIELDS)
+        self.segments.setdefault(key, Segment()).add(value)
+        self.rows[doc["id"]] = (key, value)
+
+    def remove(self, doc_id: str):
+        row = self.rows.pop(doc_id, None)
+        if row is None:
+            return
+        key, value = row
+        segment = self.segments[key]
+        segment.remove(value)
+        if not segment.n:
+            del self.segments[key]
+
+    def price_per_m2(self, group_by: Iterable[str], filters: Dict[str, str]) -> List[dict]:
+        """Merged segments grouped by `group_by` (GROUP_FIELDS), restricted by equality filters"""
+        group_by = list(group_by)
+        groups: Dict[Tuple[str, ...], Segment] = {}
+        for key, segment in self.segments.items():
+            values = dict(zip(SEGMENT_FIELDS, key))
+            values["rg"] = region_of(values["nb"])
+            if any(values[f] != v for f, v in filters.items()):
+                continue
+            group = tuple(values[f] for f in group_by)
+            groups.setdefault(group, Segment()).merge(segment)
+        return [
+            {**dict(zip(group_by, group)), **segment.summary()}
+            for group, segment in sorted(groups.items())
+        ]
+
+
+class LotAnalytics(ChangeListener):
+    """Lots offered, still available and sold per location"""
+
+    def __init__(self):
+        self.rebuild([])
+
+    def rebuild(self, docs: List[dict]):
+        self.segments: Dict[str, List[int]] = {}  # loc -> [developments, lots, dispo]
+        self.rows: Dict[str, Tuple[str, int, int]] = {}
+        for doc in docs:
+            self.add(doc)
+
+    def add(self, doc: dict):
+        self.remove(doc["id"])
+        loc = doc.get("loc") or ""
+        lots, dispo = doc.get("lots") or 0, doc.get("dispo") or 0
+        seg = self.segments.setdefault(loc, [0, 0, 0])
+        seg[0] += 1
+        seg[1] += lots
+        seg[2] += dispo
+        self.rows[doc["id"]] = (loc, lots, dispo)
+
+    def remove(self, doc_id: str):
+        row = self.rows.pop(doc_id, None)
+        if row is None:
+            return
+        loc, lots, dispo = row
+        seg = self.segments[loc]
+        seg[0] -= 1
+        seg[1] -= lots
+        seg[2] -= dispo
+        if not seg[0]:
+            del self.segments[loc]
+
+    def absorption(self) -> List[dict]:
+        out = []
+        for loc, (count, lots, dispo) in sorted(self.segments.items()):
+            sold = lots - dispo
+            out.append({
+                "loc": loc, "developments": count, "lots": lots, "dispo": dispo, "sold": sold,
+                "absorption": round(sold / lots, 4) if lots > 0 else None,
+            })
+        return out
+
+
+property_analytics = PropertyAnalytics()
+lot_analytics = LotAnalytics()
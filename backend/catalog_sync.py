@@ -0,0 +1,72 @@
+"""
+Diff-based synchronisation of a client's catalogue list with a collection.
+
+The client sends its whole list, but each entry only needs its full data
+when it is new or changed; unchanged entries can be sent as {id, h}. The
+server compares content hashes with what is stored and writes only the
+difference. Every entry carries an id chosen by the client, new ones
+included, so a retried sync finds them stored and writes nothing.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from database import content_hash
+
+
+@dataclass
+class SyncPlan:
+    upserts: List[dict] = field(default_factory=list)
+    inserted: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    # ids sent without data that the server does not have
+    missing: List[str] = field(default_factory=list)
+    # ids sent without data whose hash no longer matches the server's copy
+    stale: List[str] = field(default_factory=list)
+
+    def summary(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "deleted": self.deleted,
+            "unchanged": self.unchanged,
+            "missing": self.missing,
+            "stale": self.stale,
+        }
+
+
+def plan_sync(server_hashes: Dict[str, Optional[str]], items: List[dict]) -> SyncPlan:
+    """Work out the writes turning the stored collection into `items`.
+
+    Each item is {"id": ..., "h": ..., "data": ...} where h and data may be None.
+    """
+    plan = SyncPlan()
+    keep = set()
+    for item in items:
+        doc_id, data = item["id"], item.get("data")
+        if doc_id in keep:
+            continue  # first occurrence of a duplicated id wins
+        keep.add(doc_id)
+        if data is None:
+            if doc_id not in server_hashes:
+                plan.missing.append(doc_id)
+            elif item.get("h") and item["h"] != server_hashes[doc_id]:
+                plan.stale.append(doc_id)
+            else:
+                plan.unchanged += 1
+            continue
+
+        doc = dict(data, id=doc_id)
+        if doc_id not in server_hashes:
+            plan.inserted.append(doc_id)
+        elif server_hashes[doc_id] != content_hash(doc):
+            plan.updated.append(doc_id)
+        else:
+            plan.unchanged += 1
+            continue
+        plan.upserts.append(doc)
+
+    plan.deleted = [doc_id for doc_id in server_hashes if doc_id not in keep]
+    return plan
@@ -0,0 +1,168 @@
+"""
+Streaming NDJSON export and import of the whole catalogue.
+
+Each line is {"collection": ..., "doc": {...}}. Export walks each
+collection's cursor one batch at a time, so memory use does not grow with
+the catalogue. Import reads the request body chunk by chunk, splits it
+into lines, validates each line on its own and upserts valid documents in
+fixed-size bulk writes. A bad line is reported with its line number and
+skipped; it does not abort the import.
+"""
+
+import os
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from database import Repository
+from encoding import load_json
+
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_LINE_BYTES = int(os.environ.get("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+# Errors listed in a report; later ones are only counted
+IMPORT_MAX_ERRORS = 1000
+IMPORT_REPORTS_KEPT = 20
+
+# Turns one line's document into the document to store, or raises ValueError
+Validator = Callable[[dict], dict]
+
+
+async def export_docs(repos: Dict[str, Repository], batch_size: int = 500) -> AsyncIterator[dict]:
+    for name, repo in repos.items():
+        async for doc in repo.iter_docs(sort=[("id", 1)], batch_size=batch_size):
+            yield {"collection": name, "doc": doc}
+
+
+async def gunzip(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        out = decompressor.decompress(chunk)
+        if out:
+            yield out
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+async def split_lines(chunks: AsyncIterable[bytes], max_bytes: int = IMPORT_MAX_LINE_BYTES
+                      ) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """(line number, line) pairs; line is None when it was longer than max_bytes"""
+    number = 0
+    pending = b""
+    skipping = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not skipping:
+                    pending += chunk[start:]
+                    if len(pending) > max_bytes:
+                        pending, skipping = b"", True
+                break
+            number += 1
+            if skipping:
+                yield number, None
+            else:
+                line = pending + chunk[start:end]
+                yield number, line if len(line) <= max_bytes else None
+            pending, skipping = b"", False
+            start = end + 1
+    if skipping:
+        yield number + 1, None
+    elif pending.strip():
+        yield number + 1, pending
+
+
+@dataclass
+class ImportReport:
+    id: str
+    started_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    lines: int = 0
+    imported: Dict[str, int] = field(default_factory=dict)
+    error_count: int = 0
+    errors: List[dict] = field(default_factory=list)
+    done: bool = False
+
+    def error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "started_at": self.started_at,
+            "done": self.done,
+            "lines": self.lines,
+            "imported": self.imported,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+class CatalogImporter:
+    def __init__(self, repos: Dict[str, Repository], batch_size: int = IMPORT_BATCH_SIZE):
+        self.repos = repos
+        self.batch_size = batch_size
+        self.reports: Dict[str, ImportReport] = {}
+
+    def start(self, report_id: str) -> ImportReport:
+        report = ImportReport(report_id)
+        self.reports[report_id] = report
+        while len(self.reports) > IMPORT_REPORTS_KEPT:
+            del self.reports[next(iter(self.reports))]
+        return report
+
+    def _parse(self, raw: bytes, validators: Dict[str, Validator],
+               default_collection: Optional[str]) -> Tuple[str, dict]:
+        try:
+            item = load_json(raw)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        if not isinstance(item, dict):
+            raise ValueError("Expected a JSON object")
+        if default_collection is not None and "doc" not in item:
+            name, doc = default_collection, item
+        else:
+            name, doc = item.get("collection"), item.get("doc")
+        if name not in self.repos:
+            raise ValueError(f"Unknown collection: {name}")
+        if not isinstance(doc, dict):
+            raise ValueError("Missing doc")
+        return name, validators[name](doc)
+
+    async def run(self, chunks: AsyncIterable[bytes], report: ImportReport,
+                  validators: Dict[str, Validator], default_collection: Optional[str] = None
+                  ) -> ImportReport:
+        """Import NDJSON lines; `validators` turn each collection's docs into what is stored"""
+        batches: Dict[str, List[dict]] = {name: [] for name in self.repos}
+        try:
+            async for number, raw in split_lines(chunks):
+                report.lines = number
+                if raw is None:
+                    report.error(number, "Line too long")
+                    continue
+                if not raw.strip():
+                    continue
+                try:
+                    name, doc = self._parse(raw, validators, default_collection)
+                except ValueError as e:
+                    report.error(number, str(e))
+                    continue
+                batch = batches[name]
+                batch.append(doc)
+                if len(batch) >= self.batch_size:
+                    await self._flush(name, batch, report)
+                    batches[name] = []
+            for name, batch in batches.items():
+                if batch:
+                    await self._flush(name, batch, report)
+        finally:
+            report.done = True
+        return report
+
+    async def _flush(self, name: str, batch: List[dict], report: ImportReport):
+        await self.repos[name].upsert_many(batch)
+        report.imported[name] = report.imported.get(name, 0) + len(batch)
@@ -0,0 +1,224 @@
+"""
+Running several worker processes against one database.
+
+Each worker keeps its own in-memory state derived from the catalogue
+(response cache, search, facet, similarity and analytics indexes, view
+totals, SSE subscribers), kept current by repository listeners. Those listeners only
+see the writes made by their own process, so with more than one worker
+every write is also published to a small capped collection. Each worker
+tails it and replays the other workers' changes through its own
+repositories' listeners, after reloading the changed documents. Counter
+increments (page views) travel the same way as `inc` records carrying
+the counts, handed to the listeners registered with `subscribe_counts`.
+
+Startup work that must not run concurrently (seeding an empty database,
+backfills) runs under `mongo_lock`, a leased lock document, so the first
+worker seeds and the others find the data already there.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+
+from database import Change, Database, Repository
+
+# Worker processes; WEB_CONCURRENCY is also what gunicorn reads
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Publish changes even with one worker here, e.g. several hosts share the database
+CHANGE_FEED = WORKERS > 1 or os.environ.get("CHANGE_FEED", "").lower() in ("1", "true", "yes")
+CHANGE_FEED_COLLECTION = "changes"
+CHANGE_FEED_BYTES = int(os.environ.get("CHANGE_FEED_BYTES", str(1024 * 1024)))
+LOCK_COLLECTION = "locks"
+# Records re-read after the tail is reopened, in case they were written out of order
+REPLAY_WINDOW = 64
+TAIL_RETRY_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+@asynccontextmanager
+async def mongo_lock(database: Database, name: str, lease: float = 120, poll: float = 0.2):
+    """Hold a named lock shared by every worker using the database.
+
+    The lease bounds how long a crashed holder keeps the others waiting.
+    """
+    col = database.db[LOCK_COLLECTION]
+    owner = worker_id()
+    while True:
+        now = time.time()
+        try:
+            # Matches only an expired lock; otherwise the upsert hits the _id
+            await col.update_one(
+                {"_id": name, "until": {"$lt": now}}, {"$set": {"owner": owner, "until": now + lease}},
+                upsert=True,
+            )
+            break
+        except DuplicateKeyError:
+            await asyncio.sleep(poll)
+    try:
+        yield
+    finally:
+        await col.delete_one({"_id": name, "owner": owner})
+
+
+class ChangeFeed:
+    """Publishes local writes to the other workers and replays theirs here"""
+
+    def __init__(self, database: Database, repos: List[Repository]):
+        self.database = database
+        self.repos: Dict[str, Repository] = {repo.name: repo for repo in repos}
+        self.worker = worker_id()
+        self.outbox: List[dict] = []
+        self.published = 0
+        self.applied = 0
+        self.resyncs = 0
+        self._seen: deque = deque(maxlen=1024)
+        self._last_seq = 0
+        self._replaying = False
+        self._count_listeners: List[Callable[[str, str, Dict[str, int]], None]] = []
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def col(self):
+        return self.database.db[CHANGE_FEED_COLLECTION]
+
+    def on_change(self, change: Change):
+        if self._replaying or not self._tasks:
+            return
+        self.outbox.append({
+            "w": self.worker, "c": change.collection, "op": change.op, "id": change.id, "f": change.fields,
+        })
+        self._wakeup.set()
+
+    def publish_counts(self, collection: str, field: str, counts: Dict[str, int]):
+        """Share counter increments already written to the database"""
+        if not self._tasks or not counts:
+            return
+        self.outbox.append({"w": self.worker, "c": collection, "op": "inc", "id": None, "f": field, "n": counts})
+        self._wakeup.set()
+
+    def subscribe_counts(self, listener: Callable[[str, str, Dict[str, int]], None]):
+        self._count_listeners.append(listener)
+
+    async def start(self):
+        try:
+            await self.database.db.create_collection(
+                CHANGE_FEED_COLLECTION, capped=True, size=CHANGE_FEED_BYTES
+            )
+        except CollectionInvalid:
+            pass  # another worker created it
+        seq = await self.database.db[LOCK_COLLECTION].find_one({"_id": CHANGE_FEED_COLLECTION})
+        self._last_seq = seq["seq"] if seq else 0
+        self._tasks = [asyncio.create_task(self._publish()), asyncio.create_task(self._tail())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self.flush()
+
+    async def flush(self):
+        batch, self.outbox = self.outbox, []
+        if not batch:
+            return
+        # Sequence numbers come from one counter so a reopened tail can resume
+        counter = await self.database.db[LOCK_COLLECTION].find_one_and_update(
+            {"_id": CHANGE_FEED_COLLECTION}, {"$inc": {"seq": len(batch)}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        first = counter["seq"] - len(batch) + 1
+        for n, record in enumerate(batch):
+            record["seq"] = first + n
+        try:
+            await self.col.insert_many(batch)
+        except Exception:
+            # Publish these again with the next batch, under new numbers
+            for record in batch:
+                record.pop("seq")
+                record.pop("_id", None)
+            self.outbox[:0] = batch
+            raise
+        self.published += len(batch)
+
+    async def _publish(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Change feed publish failed")
+
+    async def _tail(self):
+        while True:
+            try:
+                oldest = await self.col.find_one({}, sort=[("$natural", 1)])
+                if oldest is not None and oldest["seq"] > self._last_seq + 1:
+                    # Records we never read were overwritten: reload everything
+                    await self.resync()
+                cursor = self.col.find(
+                    {"seq": {"$gt": self._last_seq - REPLAY_WINDOW}}, cursor_type=CursorType.TAILABLE_AWAIT,
+                )
+                async for record in cursor:
+                    await self._apply(record)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Change feed tail failed, reopening")
+            await asyncio.sleep(TAIL_RETRY_SECONDS)
+
+    async def _apply(self, record: dict):
+        seq = record["seq"]
+        if seq in self._seen:
+            return
+        self._seen.append(seq)
+        self._last_seq = max(self._last_seq, seq)
+        repo = self.repos.get(record["c"])
+        if record["w"] == self.worker or repo is None:
+            return
+        if record["op"] == "inc":
+            for listener in self._count_listeners:
+                listener(record["c"], record["f"], record["n"])
+            self.applied += 1
+            return
+        op, doc_id, docs, doc = record["op"], record["id"], None, None
+        if op == "replace":
+            docs = await repo.find_all()
+        elif op != "delete":
+            doc = await repo.find_one(doc_id)
+            if doc is None:
+                op = "delete"
+        self._notify(repo, op, doc_id, doc, docs, record.get("f"))
+        self.applied += 1
+
+    def _notify(self, repo: Repository, op: str, doc_id: Optional[str], doc: Optional[dict],
+                docs: Optional[List[dict]], fields: Optional[List[str]]):
+        self._replaying = True
+        try:
+            repo.notify(op, doc_id, doc, docs, fields)
+        finally:
+            self._replaying = False
+
+    async def resync(self):
+        """Reload every collection, for when changes may have been missed"""
+        self.resyncs += 1
+        for repo in self.repos.values():
+            self._notify(repo, "replace", None, None, await repo.find_all(), None)
@@ -0,0 +1,581 @@
+"""
+Async MongoDB data-access layer for the DIALIBATOU BTP API.
+
+All routes go through the repositories defined here so that no request
+ever blocks the event loop on a synchronous pymongo round-trip.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from metrics import MongoCommandListener
+from pymongo import (
+    ASCENDING, DESCENDING, GEOSPHERE, DeleteMany, IndexModel, ReturnDocument, UpdateMany, UpdateOne,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+MONGO_URL = os.environ.get("MONGO_URL")
+DB_NAME = os.environ.get("DB_NAME", "dialibatou")
+
+# Connection pool tuning
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_MS = int(os.environ.get("MONGO_MAX_IDLE_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# Multi-document transactions need a replica set, so they are opt-in
+MONGO_TRANSACTIONS = os.environ.get("MONGO_TRANSACTIONS", "").lower() in ("1", "true", "yes")
+
+# Small bookkeeping documents, such as which schema version was applied
+META_COLLECTION = "meta"
+
+# Content hash of each document, maintained on every write
+HASH_FIELD = "_h"
+
+# Idempotency keys of recent lot reservations / releases, kept on the lot
+RESERVE_KEYS_FIELD = "_rk"
+RELEASE_KEYS_FIELD = "_rl"
+LOT_KEYS_KEPT = 1000
+
+# Never expose Mongo's internal _id or other bookkeeping fields
+PUBLIC_PROJECTION = {"_id": 0, HASH_FIELD: 0, RESERVE_KEYS_FIELD: 0, RELEASE_KEYS_FIELD: 0}
+
+# Lot status thresholds, applied whenever availability changes
+LOT_LIMITED_THRESHOLD = int(os.environ.get("LOT_LIMITED_THRESHOLD", "20"))
+LOT_AVAILABLE = "Disponible"
+LOT_LIMITED = "Limité"
+LOT_SOLD_OUT = "Épuisé"
+
+
+def lot_status(dispo: int) -> str:
+    if dispo <= 0:
+        return LOT_SOLD_OUT
+    if dispo <= LOT_LIMITED_THRESHOLD:
+        return LOT_LIMITED
+    return LOT_AVAILABLE
+
+
+# Server error code for a unique index violation
+DUPLICATE_KEY = 11000
+# Server error codes for an index that exists under the same name or keys with other options
+INDEX_CONFLICTS = (85, 86)
+
+# Fields maintained by the server, not part of a document's content: view
+# counts, and a lot's availability, changed only by reservations and releases.
+# Wholesale writes (update, sync, import) only seed them on insert.
+COUNTER_FIELDS = ("vi", "dispo", "st")
+
+
+def content_hash(doc: dict) -> str:
+    """Stable hash of a document's content, ignoring its id, counters and bookkeeping fields"""
+    body = {
+        k: v for k, v in doc.items()
+        if k != "id" and k not in COUNTER_FIELDS and not k.startswith("_")
+    }
+    raw = json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def with_hash(doc: dict) -> dict:
+    """Copy of doc ready to store, with its content hash"""
+    stored = {k: v for k, v in doc.items() if k != "_id"}
+    stored[HASH_FIELD] = content_hash(doc)
+    return stored
+
+
+def split_counters(doc: dict) -> Tuple[dict, dict]:
+    """(doc without its counters, the counters): writers must not overwrite stored counts"""
+    content = {k: v for k, v in doc.items() if k not in COUNTER_FIELDS}
+    return content, {k: doc[k] for k in COUNTER_FIELDS if k in doc}
+
+
+class Database:
+    """Owns the Motor client; opened on startup and closed on shutdown"""
+
+    def __init__(self, url: Optional[str], name: str):
+        self.url = url
+        self.name = name
+        self.client: Optional[AsyncIOMotorClient] = None
+        self._pid: Optional[int] = None
+
+    async def connect(self):
+        self._open()
+
+    def _open(self):
+        if self.client is not None and self._pid not in (None, os.getpid()):
+            # A client inherited through fork shares sockets with the parent: open our own
+            self.client = None
+        if self.client is None:
+            self._pid = os.getpid()
+            self.client = AsyncIOMotorClient(
+                self.url,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                event_listeners=[MongoCommandListener()],
+            )
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    @property
+    def db(self):
+        """The database; the client is created on first use if connect was not called"""
+        self._open()
+        return self.client[self.name]
+
+    async def marker(self, name: str) -> Optional[int]:
+        """Version stored under `name` by set_marker, or None"""
+        doc = await self.db[META_COLLECTION].find_one({"_id": name})
+        return doc["version"] if doc else None
+
+    async def set_marker(self, name: str, version: int):
+        await self.db[META_COLLECTION].update_one({"_id": name}, {"$set": {"version": version}}, upsert=True)
+
+
+@dataclass
+class Change:
+    """A write applied to a collection, passed to every repository listener"""
+    collection: str
+    op: str  # insert, update, delete or replace (whole collection)
+    version: int
+    id: Optional[str] = None
+    doc: Optional[dict] = None
+    # Full new contents of the collection, for replace
+    docs: Optional[List[dict]] = None
+    # Top-level fields that changed, for an update; None when not known
+    fields: Optional[List[str]] = None
+
+
+class ChangeListener:
+    """An in-memory view of a collection kept in step with its writes.
+
+    Subclasses define rebuild(docs), add(doc), which replaces any row with
+    the same id, and remove(doc_id); subscribe `on_change` to the repository.
+    """
+
+    def on_change(self, change: Change):
+        if change.op == "replace":
+            self.rebuild(change.docs or [])
+        elif change.op == "delete":
+            self.remove(change.id)
+        elif change.doc is not None:
+            self.add(change.doc)
+
+
+class Repository:
+    """Async CRUD access to one collection, keyed by the public `id` field.
+
+    `version` is bumped by every write so readers can tell whether data they
+    derived from the collection is still current; listeners registered with
+    `subscribe` are called after each write.
+    """
+
+    def __init__(self, database: Database, name: str, indexes: Sequence[IndexModel] = ()):
+        self.database = database
+        self.name = name
+        self.indexes = list(indexes)
+        self.version = 0
+        self._listeners: List[Callable[[Change], None]] = []
+
+    def subscribe(self, listener: Callable[[Change], None]):
+        self._listeners.append(listener)
+
+    def _changed(
+        self, op: str, doc_id: Optional[str] = None, doc: Optional[dict] = None,
+        docs: Optional[List[dict]] = None, fields: Optional[List[str]] = None,
+    ):
+        self.version += 1
+        change = Change(self.name, op, self.version, doc_id, doc, docs, fields)
+        for listener in self._listeners:
+            listener(change)
+
+    def notify(
+        self, op: str, doc_id: Optional[str] = None, doc: Optional[dict] = None,
+        docs: Optional[List[dict]] = None, fields: Optional[List[str]] = None,
+    ):
+        """Tell listeners about a write made by another process"""
+        self._changed(op, doc_id, doc, docs, fields)
+
+    @property
+    def col(self):
+        return self.database.db[self.name]
+
+    async def find_all(
+        self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None
+    ) -> List[dict]:
+        return await self.col.find(query or {}, projection or PUBLIC_PROJECTION).to_list(length=None)
+
+    async def find_page(
+        self, query: Dict[str, Any], sort: List[Tuple[str, int]], limit: Optional[int] = None,
+        projection: Optional[Dict[str, Any]] = None,
+    ) -> List[dict]:
+        cursor = self.col.find(query, projection or PUBLIC_PROJECTION).sort(sort)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def find_fields(
+        self, query: Dict[str, Any], projection: Dict[str, int], limit: Optional[int] = None
+    ) -> List[dict]:
+        """Only the given fields of matching documents, in the query's natural order"""
+        cursor = self.col.find(query, projection)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=limit)
+
+    def iter_docs(
+        self, query: Optional[Dict[str, Any]] = None, sort: Optional[List[Tuple[str, int]]] = None,
+        limit: Optional[int] = None, batch_size: int = 500, projection: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[dict]:
+        """Stream matching documents, holding one cursor batch at a time"""
+        cursor = self.col.find(query or {}, projection or PUBLIC_PROJECTION, batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    async def find_one(self, doc_id: str) -> Optional[dict]:
+        return await self.col.find_one({"id": doc_id}, PUBLIC_PROJECTION)
+
+    async def ensure_indexes(self) -> bool:
+        """Create the indexes; one that exists with other options (say, not yet unique) is rebuilt.
+
+        A unique index the stored documents violate is created without
+        `unique` instead, the duplicate values are logged and False is
+        returned, so the caller can try again once they are cleaned up.
+        """
+        complete = True
+        for index in self.indexes:
+            try:
+                await self._create_index(index)
+            except DuplicateKeyError:
+                spec = dict(index.document)
+                del spec["unique"]
+                await self._create_index(IndexModel(list(spec.pop("key").items()), **spec))
+                logger.error("%s.%s is not unique, duplicates: %s", self.name, spec["name"],
+                             await self.duplicates(list(index.document["key"])))
+                complete = False
+        return complete
+
+    async def _create_index(self, index: IndexModel):
+        try:
+            await self.col.create_indexes([index])
+        except DuplicateKeyError:
+            raise
+        except OperationFailure as e:
+            # mongomock raises the conflict without a code
+            if e.code not in INDEX_CONFLICTS and not (e.code is None and "already exists" in str(e)):
+                raise
+            await self.col.drop_index(index.document["name"])
+            await self.col.create_indexes([index])
+
+    async def duplicates(self, fields: List[str], limit: int = 20) -> List[dict]:
+        """Values of `fields` shared by more than one document"""
+        pipeline = [
+            {"$group": {"_id": {f: f"${f}" for f in fields}, "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+            {"$limit": limit},
+        ]
+        return [d["_id"] async for d in self.col.aggregate(pipeline)]
+
+    async def refresh_hashes(self) -> int:
+        """Rewrite stored content hashes that differ from content_hash; returns how many did"""
+        ops = []
+        async for d in self.col.find({}, {"_id": 0, RESERVE_KEYS_FIELD: 0, RELEASE_KEYS_FIELD: 0}):
+            h = content_hash(d)
+            if d.get(HASH_FIELD) != h:
+                ops.append(UpdateOne({"id": d["id"]}, {"$set": {HASH_FIELD: h}}))
+        if ops:
+            await self.col.bulk_write(ops, ordered=False)
+        return len(ops)
+
+    async def rename_ids(
+        self, rename: Callable[[str], str], refs: Sequence[Tuple["Repository", str]] = (),
+    ) -> Dict[str, str]:
+        """Give every document the id rename(id), and point each `(repo, field)` reference at it.
+
+        Returns the ids that changed, old to new. The content hash leaves
+        out the id, so it stays valid.
+        """
+        renamed = {}
+        async for d in self.col.find({}, {"_id": 0, "id": 1}):
+            new = rename(d["id"])
+            if new != d["id"]:
+                renamed[d["id"]] = new
+        if renamed:
+            await self.col.bulk_write(
+                [UpdateOne({"id": old}, {"$set": {"id": new}}) for old, new in renamed.items()], ordered=False
+            )
+            for repo, field in refs:
+                await repo.col.bulk_write(
+                    [UpdateMany({field: old}, {"$set": {field: new}}) for old, new in renamed.items()],
+                    ordered=False,
+                )
+        return renamed
+
+    async def count(self) -> int:
+        return await self.col.count_documents({})
+
+    async def hashes(self) -> Dict[str, Optional[str]]:
+        """Map of every id to its stored content hash"""
+        cursor = self.col.find({}, {"_id": 0, "id": 1, HASH_FIELD: 1})
+        return {d["id"]: d.get(HASH_FIELD) async for d in cursor}
+
+    async def insert(self, doc: dict):
+        """Insert one doc; raises DuplicateId if its id is already stored"""
+        try:
+            await self.col.insert_one(with_hash(doc))
+        except DuplicateKeyError:
+            raise DuplicateId(doc["id"])
+        self._changed("insert", doc["id"], doc)
+
+    async def insert_many(self, docs: List[dict]):
+        """Insert docs in one unordered write; ids already stored are skipped.
+
+        Needs a unique index on `id`, so that retrying a batch which was
+        partly written does not store duplicates.
+        """
+        skipped = set()
+        try:
+            await self.col.insert_many([with_hash(d) for d in docs], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if e.details.get("writeConcernErrors") or any(err.get("code") != DUPLICATE_KEY for err in errors):
+                await self._reload()
+                raise
+            skipped = {err["index"] for err in errors}
+        for i, doc in enumerate(docs):
+            if i not in skipped:
+                self._changed("insert", doc["id"], doc)
+
+    async def update(self, doc_id: str, doc: dict) -> Optional[dict]:
+        """Set the fields of doc, except counters; returns the stored doc, or None if not found"""
+        content, _ = split_counters(doc)
+        before = await self.col.find_one_and_update(
+            {"id": doc_id}, {"$set": with_hash(content)}, projection=PUBLIC_PROJECTION,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            return None
+        doc = dict(content, **split_counters(before)[1])
+        fields = [k for k, v in doc.items() if before.get(k) != v]
+        self._changed("update", doc_id, doc, fields=fields)
+        return doc
+
+    async def delete(self, doc_id: str) -> bool:
+        result = await self.col.delete_one({"id": doc_id})
+        if result.deleted_count == 0:
+            return False
+        self._changed("delete", doc_id)
+        return True
+
+    async def replace_all(self, docs: List[dict]):
+        try:
+            await self.col.delete_many({})
+            if docs:
+                await self.col.insert_many([with_hash(d) for d in docs])
+        except Exception:
+            await self._reload()
+            raise
+        self._changed("replace", docs=docs)
+
+    async def _reload(self):
+        """After a write that may have been partly applied, tell listeners what Mongo holds"""
+        try:
+            docs = await self.find_all()
+        except Exception:
+            # Unreachable: at least stop serving responses derived before the write
+            self.version += 1
+            return
+        self._changed("replace", docs=docs)
+
+    async def increment(self, field: str, counts: Dict[str, int]):
+        """Add counts[id] to `field` of each document in one unordered bulk write.
+
+        Counter bumps do not notify listeners: readers may see them late.
+        """
+        if counts:
+            ops = [UpdateOne({"id": doc_id}, {"$inc": {field: n}}) for doc_id, n in counts.items()]
+            await self.col.bulk_write(ops, ordered=False)
+
+    async def upsert_many(self, docs: List[dict]):
+        """Insert or replace docs by id in one bulk write"""
+        ids = [d["id"] for d in docs]
+        existing = {d["id"] async for d in self.col.find({"id": {"$in": ids}}, {"_id": 0, "id": 1})}
+        await self.apply_sync(docs, [], existing)
+
+    async def apply_sync(self, upserts: List[dict], deletes: List[str], existing: set):
+        """Apply upserts and deletes in one unordered bulk write.
+
+        `existing` holds the ids already stored, to tell inserts from updates
+        when notifying listeners. Counters in the upserts only seed new
+        documents; stored counts are kept.
+        """
+        updated = [d["id"] for d in upserts if d["id"] in existing]
+        stored_counters = {}
+        if updated:
+            projection = {"_id": 0, "id": 1, **{f: 1 for f in COUNTER_FIELDS}}
+            stored_counters = {
+                d["id"]: split_counters(d)[1] async for d in self.col.find({"id": {"$in": updated}}, projection)
+            }
+        ops, upserts = [], list(upserts)
+        for i, d in enumerate(upserts):
+            content, counters = split_counters(d)
+            update = {"$set": with_hash(content)}
+            if counters:
+                update["$setOnInsert"] = counters
+            ops.append(UpdateOne({"id": d["id"]}, update, upsert=True))
+            upserts[i] = dict(content, **stored_counters.get(d["id"], counters))
+        if deletes:
+            ops.append(DeleteMany({"id": {"$in": deletes}}))
+        if not ops:
+            return
+        if MONGO_TRANSACTIONS:
+            # A failed transaction is rolled back: nothing changed, nothing to tell
+            async with await self.database.client.start_session() as session:
+                async with session.start_transaction():
+                    await self.col.bulk_write(ops, ordered=False, session=session)
+        else:
+            try:
+                await self.col.bulk_write(ops, ordered=False)
+            except Exception:
+                await self._reload()
+                raise
+        for d in upserts:
+            self._changed("update" if d["id"] in existing else "insert", d["id"], d)
+        for doc_id in deletes:
+            self._changed("delete", doc_id)
+
+
+class DuplicateId(Exception):
+    pass
+
+
+class LotNotFound(Exception):
+    pass
+
+
+class NotEnoughLots(Exception):
+    pass
+
+
+class LotKeyMismatch(Exception):
+    """An idempotency key reused with another number of plots"""
+
+
+def find_key(entries: list, key: str) -> Optional[dict]:
+    """The recorded entry of an idempotency key, as {k, n, dispo}; n and dispo may be missing"""
+    for entry in entries:
+        if entry == key:
+            return {"k": key}
+        if isinstance(entry, dict) and entry.get("k") == key:
+            return entry
+    return None
+
+
+class LotRepository(Repository):
+    """Lots, with atomic reservation and release of available plots"""
+
+    async def reserve(self, lot_id: str, n: int, key: Optional[str] = None) -> Tuple[dict, bool]:
+        """Take n plots if at least n are available; returns (lot, replayed)"""
+        return await self._adjust(lot_id, -n, key, RESERVE_KEYS_FIELD, {"dispo": {"$gte": n}})
+
+    async def release(self, lot_id: str, n: int, key: Optional[str] = None) -> Tuple[dict, bool]:
+        """Give back n plots, never going above the lot's total"""
+        guard = {"$expr": {"$lte": [{"$add": ["$dispo", n]}, "$lots"]}}
+        return await self._adjust(lot_id, n, key, RELEASE_KEYS_FIELD, guard)
+
+    async def _adjust(self, lot_id: str, delta: int, key: Optional[str], key_field: str, guard: dict):
+        # The guard and the increment are one atomic update, so concurrent
+        # reservations can never take dispo below zero. An idempotency key is
+        # recorded in the same update as {k, n}, and a retry carrying it
+        # matches nothing; the dispo it left is added once known, for replays.
+        query = {"id": lot_id, **guard}
+        # dispo and st are outside the content hash, which stays valid
+        update = {"$inc": {"dispo": delta}}
+        if key:
+            # Keys recorded before they carried n are bare strings
+            query[key_field] = {"$ne": key}
+            query[f"{key_field}.k"] = {"$ne": key}
+            update["$push"] = {key_field: {"$each": [{"k": key, "n": abs(delta)}], "$slice": -LOT_KEYS_KEPT}}
+        lot = await self.col.find_one_and_update(
+            query, update, projection=PUBLIC_PROJECTION, return_document=ReturnDocument.BEFORE
+        )
+        if lot is None:
+            current = await self.col.find_one({"id": lot_id}, {"_id": 0, key_field: 1})
+            if current is None:
+                raise LotNotFound(lot_id)
+            entry = find_key(current.get(key_field, []), key) if key else None
+            if entry is None:
+                raise NotEnoughLots(lot_id)
+            if entry.get("n", abs(delta)) != abs(delta):
+                raise LotKeyMismatch(key)
+            lot = await self.find_one(lot_id)
+            if "dispo" in entry:
+                # The response of the attempt that applied the key
+                lot.update(dispo=entry["dispo"], st=lot_status(entry["dispo"]))
+            return lot, True
+
+        lot["dispo"] += delta
+        fields = ["dispo"]
+        status = lot_status(lot["dispo"])
+        if lot.get("st") != status:
+            # Conditional on dispo: if another reservation got in between, its
+            # own status update (for the newer dispo) is the one that applies
+            await self.col.update_one({"id": lot_id, "dispo": lot["dispo"]}, {"$set": {"st": status}})
+            lot["st"] = status
+            fields.append("st")
+        if key:
+            await self.col.update_one(
+                {"id": lot_id, f"{key_field}.k": key}, {"$set": {f"{key_field}.$.dispo": lot["dispo"]}}
+            )
+        self._changed("update", lot_id, lot, fields=fields)
+        return lot, False
+
+
+# Compound indexes backing the listing filters: equality fields first,
+# then the sort field, then `id` as the keyset tie-breaker.
+PROPERTY_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_1", unique=True),
+    IndexModel([("tr", ASCENDING), ("ty", ASCENDING), ("pr", ASCENDING), ("id", ASCENDING)]),
+    IndexModel([("nb", ASCENDING), ("tr", ASCENDING), ("pr", ASCENDING), ("id", ASCENDING)]),
+    IndexModel([("pr", ASCENDING), ("id", ASCENDING)]),
+    IndexModel([("su", ASCENDING), ("id", ASCENDING)]),
+    IndexModel([("be", ASCENDING), ("id", ASCENDING)]),
+    IndexModel([("vi", DESCENDING), ("id", DESCENDING)]),
+    IndexModel([("geo", GEOSPHERE)]),
+]
+
+LOT_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_1", unique=True),
+    IndexModel([("geo", GEOSPHERE)]),
+]
+
+# Leads are listed newest first, optionally for one property or lot
+# The sender's address is kept for abuse handling, never served
+MESSAGE_PROJECTION = {**PUBLIC_PROJECTION, "ip": 0}
+
+MESSAGE_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_1", unique=True),
+    IndexModel([("at", DESCENDING), ("id", DESCENDING)]),
+    IndexModel([("pid", ASCENDING), ("at", DESCENDING), ("id", DESCENDING)]),
+    IndexModel([("lot", ASCENDING), ("at", DESCENDING), ("id", DESCENDING)]),
+]
+
+database = Database(MONGO_URL, DB_NAME)
+properties_repo = Repository(database, "properties", PROPERTY_INDEXES)
+lots_repo = LotRepository(database, "lots", LOT_INDEXES)
+messages_repo = Repository(database, "messages", MESSAGE_INDEXES)
@@ -0,0 +1,119 @@
+"""
+Response encoding: JSON and NDJSON bodies, gzip and brotli compression.
+
+Documents are validated when they are written, so reads encode what Mongo
+returns straight to bytes instead of rebuilding response models. orjson
+is used when installed (several times faster than the json module on
+catalogue lists), brotli likewise; without them the standard library
+json and gzip are used.
+"""
+
+import gzip
+import json
+import os
+import zlib
+from typing import AsyncIterable, AsyncIterator, Optional
+
+try:
+    import orjson
+except ImportError:  # falls back to the json module
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Bodies smaller than this are not worth a compression round
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def dump_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def load_json(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best content coding we support among those the client accepts"""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """Incremental compressor whose output can be flushed chunk by chunk"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.flush()
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._c.finish() if self.encoding == "br" else self._c.flush()
+
+
+async def ndjson_chunks(docs: AsyncIterable[dict], batch: int = 500) -> AsyncIterator[bytes]:
+    """One JSON document per line, yielded `batch` lines at a time"""
+    lines = []
+    async for doc in docs:
+        lines.append(dump_json(doc))
+        if len(lines) >= batch:
+            lines.append(b"")
+            yield b"\n".join(lines)
+            lines = []
+    if lines:
+        lines.append(b"")
+        yield b"\n".join(lines)
+
+
+async def compressed(chunks: AsyncIterable[bytes], encoding: Optional[str]) -> AsyncIterator[bytes]:
+    if encoding is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+    compressor = StreamCompressor(encoding)
+    async for chunk in chunks:
+        out = compressor.chunk(chunk)
+        if out:
+            yield out
+    yield compressor.finish()
@@ -0,0 +1,164 @@
+"""
+Server-Sent Events fan-out for catalogue changes.
+
+Every repository write is turned into one compact event, serialized once
+and pushed to a bounded queue per connected client. Idle clients simply
+wait on their queue, with a heartbeat comment now and then to keep
+proxies from closing the connection. A client whose queue fills up is
+evicted: its backlog is dropped and it is told to refetch, so one slow
+reader never holds memory or slows down the others.
+
+Events carry the changed field names and the new values of small card
+fields only, never whole documents (images may be inlined as base64):
+clients fetch a listing when they need the rest.
+
+Recent events are kept in a short backlog, bounded by count and bytes,
+so a client reconnecting with Last-Event-ID gets what it missed instead
+of refetching everything. Event ids are "<epoch>-<seq>", the epoch being
+random per process: a client reconnecting to another worker, or after a
+restart, presents an id from another numbering and is told to reset.
+"""
+
+import asyncio
+import os
+import secrets
+from collections import deque
+from typing import AsyncIterator, Deque, Optional, Set, Tuple
+
+from database import Change
+from encoding import dump_json
+from queries import LOT_CARD_FIELDS, PROPERTY_CARD_FIELDS
+
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_BACKLOG = int(os.environ.get("EVENTS_BACKLOG", "1024"))
+EVENTS_BACKLOG_BYTES = int(os.environ.get("EVENTS_BACKLOG_BYTES", str(1024 * 1024)))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "25"))
+
+HEARTBEAT = b": ping\n\n"
+RETRY_MS = 3000
+
+# Fields whose new values ride along in events: card fields, less the images
+EVENT_FIELDS = {
+    "properties": tuple(f for f in PROPERTY_CARD_FIELDS if f != "im"),
+    "lots": LOT_CARD_FIELDS,
+}
+
+
+def change_event(change: Change) -> dict:
+    """Compact description of a change: id, changed field names and small card values"""
+    event = {"collection": change.collection, "op": change.op, "version": change.version}
+    if change.op == "replace":
+        return event
+    event["id"] = change.id
+    if change.fields is not None:
+        event["fields"] = change.fields
+    if change.doc is not None:
+        carried = EVENT_FIELDS.get(change.collection, ())
+        if change.fields is not None:
+            carried = [f for f in change.fields if f in carried]
+        event["data"] = {k: change.doc[k] for k in carried if k in change.doc}
+    return event
+
+
+class Subscriber:
+    __slots__ = ("queue", "evicted")
+
+    def __init__(self, size: int):
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(size)
+        self.evicted = False
+
+
+class EventHub:
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, backlog: int = EVENTS_BACKLOG,
+                 backlog_bytes: int = EVENTS_BACKLOG_BYTES):
+        self.queue_size = queue_size
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.subscribers: Set[Subscriber] = set()
+        self.evictions = 0
+        self.backlog = backlog
+        self.backlog_bytes = backlog_bytes
+        self._backlog: Deque[Tuple[int, bytes]] = deque()
+        self._backlog_size = 0
+
+    def on_change(self, change: Change):
+        self.publish(change_event(change))
+
+    def publish(self, event: dict):
+        self.seq += 1
+        frame = b"id: %s\nevent: change\ndata: %s\n\n" % (self._event_id(), dump_json(event))
+        self._backlog.append((self.seq, frame))
+        self._backlog_size += len(frame)
+        while len(self._backlog) > self.backlog or self._backlog_size > self.backlog_bytes:
+            self._backlog_size -= len(self._backlog.popleft()[1])
+        for sub in self.subscribers:
+            if sub.evicted:
+                continue
+            try:
+                sub.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self._evict(sub)
+
+    def _event_id(self) -> bytes:
+        return b"%s-%d" % (self.epoch.encode(), self.seq)
+
+    def _reset(self) -> bytes:
+        """Tells a client it cannot be caught up and must refetch the catalogue.
+
+        The frame carries the current event id, so the client resumes from
+        here when it reconnects.
+        """
+        return b"id: %s\nevent: reset\ndata: {}\n\n" % self._event_id()
+
+    def _evict(self, sub: Subscriber):
+        sub.evicted = True
+        self.evictions += 1
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(self._reset())
+
+    def _missed(self, last_id: Optional[str]) -> Optional[list]:
+        """Frames after last_id, or None if they are no longer all available"""
+        epoch, _, seq = (last_id or "").partition("-")
+        if epoch != self.epoch:
+            return None  # another worker's or an earlier process's numbering
+        try:
+            last = int(seq)
+        except ValueError:
+            return None
+        if last > self.seq:
+            return None
+        if last == self.seq:
+            return []
+        if not self._backlog or self._backlog[0][0] > last + 1:
+            return None
+        return [frame for seq, frame in self._backlog if seq > last]
+
+    async def stream(self, last_event_id: Optional[str] = None,
+                     heartbeat: float = EVENTS_HEARTBEAT_SECONDS) -> AsyncIterator[bytes]:
+        sub = Subscriber(self.queue_size)
+        self.subscribers.add(sub)
+        # Taken together with subscribing, so nothing is missed or sent twice
+        if last_event_id is None:
+            prelude = [b"retry: %d\nid: %s\n\n" % (RETRY_MS, self._event_id())]
+        else:
+            prelude = self._missed(last_event_id)
+            if prelude is None:
+                prelude = [self._reset()]
+        try:
+            for frame in prelude:
+                yield frame
+            while True:
+                try:
+                    frame = await asyncio.wait_for(sub.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                    continue
+                yield frame
+                if sub.evicted and sub.queue.empty():
+                    return
+        finally:
+            self.subscribers.discard(sub)
+
+
+event_hub = EventHub()
@@ -0,0 +1,127 @@
+"""
+Facet counts and price statistics for the property catalogue.
+
+Per facet value (quartier, region, type, transaction, feature) a sorted
+list of prices is kept up to date on every write, so the unfiltered
+facets are read in O(number of values) and min/median/max are direct
+lookups. Filtered facets are computed from compact in-memory rows,
+without a round-trip to Mongo.
+"""
+
+from bisect import bisect_left, insort
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from database import ChangeListener
+from quartiers import region_of
+
+# Fields kept per property to evaluate listing filters in memory
+ROW_FIELDS = ("ty", "tr", "nb", "pr", "su", "be", "ft")
+
+FACETS = ("nb", "rg", "ty", "tr", "fe")
+
+
+def facet_values(row: Dict[str, Any], facet: str) -> Iterable[str]:
+    if facet == "fe":
+        return set(row.get("fe") or [])
+    if facet == "rg":
+        return (region_of(row.get("nb") or ""),)
+    value = row.get(facet)
+    return (value,) if value else ()
+
+
+class PriceStats:
+    """Sorted prices of the listings sharing one facet value"""
+
+    __slots__ = ("prices",)
+
+    def __init__(self):
+        self.prices: List[int] = []
+
+    def add(self, price: int):
+        insort(self.prices, price)
+
+    def remove(self, price: int):
+        i = bisect_left(self.prices, price)
+        if i < len(self.prices) and self.prices[i] == price:
+            del self.prices[i]
+
+    def summary(self) -> dict:
+        return price_summary(self.prices)
+
+
+def price_summary(prices: List[int]) -> dict:
+    """Count and min/median/max of an already sorted price list"""
+    n = len(prices)
+    if n == 0:
+        return {"count": 0, "min": None, "median": None, "max": None}
+    mid = n // 2
+    median = prices[mid] if n % 2 else (prices[mid - 1] + prices[mid]) // 2
+    return {"count": n, "min": prices[0], "median": median, "max": prices[-1]}
+
+
+class FacetIndex(ChangeListener):
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+        self.tables: Dict[str, Dict[str, PriceStats]] = {f: {} for f in FACETS}
+
+    def rebuild(self, docs: List[dict]):
+        self.rows = {}
+        self.tables = {f: {} for f in FACETS}
+        for doc in docs:
+            self.add(doc)
+
+    def add(self, doc: dict):
+        if doc["id"] in self.rows:
+            self.remove(doc["id"])
+        row = {f: doc.get(f) for f in ROW_FIELDS}
+        row["pr"] = row["pr"] or 0
+        row["fe"] = list(doc.get("fe") or [])
+        self.rows[doc["id"]] = row
+        for facet in FACETS:
+            for value in facet_values(row, facet):
+                self.tables[facet].setdefault(value, PriceStats()).add(row["pr"])
+
+    def remove(self, doc_id: str):
+        row = self.rows.pop(doc_id, None)
+        if row is None:
+            return
+        for facet in FACETS:
+            table = self.tables[facet]
+            for value in facet_values(row, facet):
+                stats = table.get(value)
+                if stats is None:
+                    continue
+                stats.remove(row["pr"])
+                if not stats.prices:
+                    del table[value]
+
+    def facets(self, predicate: Optional[Callable[[dict], bool]] = None) -> dict:
+        """Counts and price stats per facet value, over the rows matching predicate"""
+        if predicate is None:
+            return {
+                "total": len(self.rows),
+                "facets": {
+                    facet: {value: stats.summary() for value, stats in sorted(table.items())}
+                    for facet, table in self.tables.items()
+                },
+            }
+
+        prices: Dict[str, Dict[str, List[int]]] = {f: {} for f in FACETS}
+        total = 0
+        for row in self.rows.values():
+            if not predicate(row):
+                continue
+            total += 1
+            for facet in FACETS:
+                for value in facet_values(row, facet):
+                    prices[facet].setdefault(value, []).append(row["pr"])
+        return {
+            "total": total,
+            "facets": {
+                facet: {value: price_summary(sorted(p)) for value, p in sorted(table.items())}
+                for facet, table in prices.items()
+            },
+        }
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,144 @@
+"""
+Map support: GeoJSON points, geo queries and marker clustering.
+
+Listings and lots store an optional GeoJSON point in `geo`, indexed with
+2dsphere. Documents without one get the centroid of their quartier
+(properties) or location (lots), and `geo_src` records which it is: a
+derived centroid follows the document when its place changes, an exact
+point is kept. Map endpoints return small marker
+payloads instead of whole documents. At low zoom, markers falling in the
+same grid cell are merged into one cluster, so a zoomed-out map of
+thousands of listings loads a few dozen points.
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from quartiers import COORDS, centroid
+
+GEO_FIELD = "geo"
+GEO_SOURCE_FIELD = "geo_src"
+CENTROID = "centroid"
+EXACT = "exact"
+_CENTROIDS = {(lon, lat) for lat, lon in COORDS.values()}
+EARTH_RADIUS_M = 6_371_000
+# From this zoom level on, markers are returned one by one
+CLUSTER_MAX_ZOOM = 15
+# Markers closer than this many screen pixels share a cluster
+CLUSTER_RADIUS_PX = 60
+TILE_SIZE_PX = 256
+
+# Fields of a marker, per collection; `id` and the point are always included
+MARKER_FIELDS = {
+    "properties": ("ti", "ty", "tr", "pr", "nb"),
+    "lots": ("loc", "zone", "dispo", "pr", "st"),
+}
+
+
+def point(lat: float, lon: float) -> dict:
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def place_point(place: Optional[str]) -> Optional[dict]:
+    """GeoJSON point at the centroid of a quartier or lot location"""
+    coords = centroid(place or "")
+    return point(*coords) if coords else None
+
+
+def resolve_point(geo: Optional[dict], place: Optional[str]) -> Tuple[Optional[dict], Optional[str]]:
+    """A document's point and its source.
+
+    An exact point is kept. A missing point, or the centroid of any place
+    (the document may have moved to another quartier since), becomes the
+    centroid of `place`.
+    """
+    if geo and tuple(geo["coordinates"]) not in _CENTROIDS:
+        return geo, EXACT
+    derived = place_point(place)
+    return (derived, CENTROID) if derived else (None, None)
+
+
+def lat_lon(doc: dict) -> Optional[Tuple[float, float]]:
+    geo = doc.get(GEO_FIELD)
+    if not geo:
+        return None
+    lon, lat = geo["coordinates"]
+    return lat, lon
+
+
+def distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Great-circle distance between two (lat, lon) pairs"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+
+def near_query(lat: float, lon: float, max_m: float) -> Dict[str, Any]:
+    """Documents within max_m metres, nearest first (needs the 2dsphere index)"""
+    return {GEO_FIELD: {"$nearSphere": {"$geometry": point(lat, lon), "$maxDistance": max_m}}}
+
+
+def bbox_query(west: float, south: float, east: float, north: float) -> Dict[str, Any]:
+    ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+    return {GEO_FIELD: {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}}
+
+
+def marker_projection(collection: str) -> Dict[str, int]:
+    projection = {"_id": 0, "id": 1, GEO_FIELD: 1}
+    projection.update({f: 1 for f in MARKER_FIELDS[collection]})
+    return projection
+
+
+def marker(doc: dict, collection: str) -> dict:
+    lat, lon = lat_lon(doc)
+    out = {"type": "marker", "collection": collection, "id": doc["id"], "lat": lat, "lon": lon}
+    out.update({f: doc.get(f) for f in MARKER_FIELDS[collection]})
+    return out
+
+
+async def backfill(repo, place_field: str, batch_size: int = 500) -> int:
+    """Resolve the point of documents without an exact one (see resolve_point); returns how many changed"""
+    batch, done = [], 0
+    async for doc in repo.iter_docs({GEO_SOURCE_FIELD: {"$ne": EXACT}}, batch_size=batch_size):
+        geo, source = resolve_point(doc.get(GEO_FIELD), doc.get(place_field))
+        if geo == doc.get(GEO_FIELD) and source == doc.get(GEO_SOURCE_FIELD):
+            continue
+        batch.append(dict(doc, **{GEO_FIELD: geo, GEO_SOURCE_FIELD: source}))
+        if len(batch) >= batch_size:
+            await repo.upsert_many(batch)
+            done += len(batch)
+            batch = []
+    if batch:
+        await repo.upsert_many(batch)
+        done += len(batch)
+    return done
+
+
+def cell_size_deg(zoom: int) -> float:
+    """Width in degrees of CLUSTER_RADIUS_PX at a web map zoom level"""
+    return 360 / (TILE_SIZE_PX * 2 ** zoom) * CLUSTER_RADIUS_PX
+
+
+def cluster(markers: List[dict], zoom: int) -> List[dict]:
+    """Merge markers sharing a grid cell into clusters, below CLUSTER_MAX_ZOOM"""
+    if zoom >= CLUSTER_MAX_ZOOM:
+        return markers
+    size = cell_size_deg(zoom)
+    cells: Dict[Tuple[int, int], List[dict]] = {}
+    for m in markers:
+        cells.setdefault((math.floor(m["lat"] / size), math.floor(m["lon"] / size)), []).append(m)
+    out = []
+    for members in cells.values():
+        if len(members) == 1:
+            out.append(members[0])
+            continue
+        prices = [m["pr"] for m in members if m.get("pr")]
+        out.append({
+            "type": "cluster",
+            "lat": sum(m["lat"] for m in members) / len(members),
+            "lon": sum(m["lon"] for m in members) / len(members),
+            "count": len(members),
+            "pr_min": min(prices) if prices else None,
+            "pr_max": max(prices) if prices else None,
+        })
+    return out
@@ -0,0 +1,325 @@
+"""
+Idempotency-Key support for write requests.
+
+A client that may retry a write (flaky mobile connections) sends the
+same `Idempotency-Key` header with every attempt. The first attempt runs
+and its response (status, headers, body) is stored under the key; later
+attempts get that response back, marked `Idempotent-Replayed: true`,
+without running the route again.
+
+Keys live in a Mongo collection whose TTL index drops them after
+IDEMPOTENCY_TTL_SECONDS, shared by every worker, with an in-process LRU
+in front so a retry usually costs no database read. Concurrent attempts
+with one key run the route once: attempts in the same process wait on
+the first one; attempts in another worker find its pending record and
+poll until the response is stored.
+
+The request body is read before anything else, hashed and spooled
+(to disk past IDEMPOTENCY_SPOOL_BYTES), then fed to the route. The key
+is bound to the method, path, query and body hash: a key reused for
+another request, or the same route with another payload, gets 422.
+Server errors (5xx) are not stored and release the key, so a retry runs
+the route again.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+
+from database import Database
+from encoding import dump_json
+
+IDEMPOTENCY_COLLECTION = "idempotency"
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_CACHE_ENTRIES = int(os.environ.get("IDEMPOTENCY_CACHE_ENTRIES", "1000"))
+# A pending record older than this belongs to a crashed worker and may be taken over
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "60"))
+# Larger responses are not stored: a retry runs the route again
+IDEMPOTENCY_MAX_BODY = int(os.environ.get("IDEMPOTENCY_MAX_BODY", str(1024 * 1024)))
+# Request bodies larger than this are spooled to a temporary file while hashed
+IDEMPOTENCY_SPOOL_BYTES = int(os.environ.get("IDEMPOTENCY_SPOOL_BYTES", str(8 * 1024 * 1024)))
+MAX_KEY_LENGTH = 200
+BODY_CHUNK = 64 * 1024
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+POLL_SECONDS = 0.05
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+
+class KeyMismatch(Exception):
+    pass
+
+
+class KeyInProgress(Exception):
+    pass
+
+
+class IdempotencyStore:
+    """Stored responses by key: Mongo for every worker, an LRU for this one"""
+
+    def __init__(self, database: Database, max_entries: int = IDEMPOTENCY_CACHE_ENTRIES):
+        self.database = database
+        self.max_entries = max_entries
+        self.executed = 0
+        self.replayed = 0
+        self.mismatched = 0
+        # key -> (fingerprint, expiry, response)
+        self._entries: "OrderedDict[str, Tuple[str, float, StoredResponse]]" = OrderedDict()
+        # key -> (fingerprint, future of the response, None if it was not stored)
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    @property
+    def col(self):
+        return self.database.db[IDEMPOTENCY_COLLECTION]
+
+    async def ensure_indexes(self):
+        await self.col.create_indexes([
+            IndexModel([("at", ASCENDING)], name="at_ttl", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS),
+        ])
+
+    def cached(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.time():
+            del self._entries[key]
+            return None
+        if entry[0] != fingerprint:
+            raise KeyMismatch(key)
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def _remember(self, key: str, fingerprint: str, expiry: float, response: StoredResponse):
+        self._entries[key] = (fingerprint, expiry, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """None if the caller now owns `key` and must run the request; else the response to replay"""
+        deadline = time.time() + IDEMPOTENCY_LEASE_SECONDS
+        while True:
+            now = time.time()
+            try:
+                await self.col.insert_one({
+                    "_id": key, "fp": fingerprint, "st": PENDING, "ts": now,
+                    "at": datetime.fromtimestamp(now, timezone.utc),
+                })
+                return None
+            except DuplicateKeyError:
+                pass
+            record = await self.col.find_one({"_id": key})
+            if record is None:
+                continue  # released or expired meanwhile
+            if record["fp"] != fingerprint:
+                raise KeyMismatch(key)
+            if record["st"] == DONE:
+                response = StoredResponse(record["status"], [tuple(h) for h in record["headers"]], record["body"])
+                self._remember(key, fingerprint, record["ts"] + IDEMPOTENCY_TTL_SECONDS, response)
+                return response
+            if record["ts"] < now - IDEMPOTENCY_LEASE_SECONDS:
+                taken = await self.col.update_one(
+                    {"_id": key, "st": PENDING, "ts": record["ts"]}, {"$set": {"ts": now}}
+                )
+                if taken.modified_count:
+                    return None
+            if now > deadline:
+                raise KeyInProgress(key)
+            await asyncio.sleep(POLL_SECONDS)
+
+    async def save(self, key: str, fingerprint: str, response: StoredResponse):
+        now = time.time()
+        await self.col.update_one({"_id": key}, {"$set": {
+            "st": DONE, "ts": now, "at": datetime.fromtimestamp(now, timezone.utc),
+            "status": response.status, "headers": [list(h) for h in response.headers], "body": response.body,
+        }})
+        self._remember(key, fingerprint, now + IDEMPOTENCY_TTL_SECONDS, response)
+
+    async def release(self, key: str):
+        await self.col.delete_one({"_id": key, "st": PENDING})
+
+    async def run(self, key: str, fingerprint: str, execute) -> Tuple[Optional[StoredResponse], bool]:
+        """The response for `key`, running `execute` only if no attempt ran or is running.
+
+        `execute()` sends the response to the client itself and returns it,
+        or None if it must not be stored. Returns (response to replay,
+        True) or (None, False) once `execute` ran here.
+        """
+        while True:
+            response = self.cached(key, fingerprint)
+            if response is not None:
+                self.replayed += 1
+                return response, True
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            if inflight[0] != fingerprint:
+                raise KeyMismatch(key)
+            response = await asyncio.shield(inflight[1])
+            if response is not None:
+                self.replayed += 1
+                return response, True
+            # The first attempt failed: try again ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, future)
+        response = None
+        try:
+            stored = await self.claim(key, fingerprint)
+            if stored is not None:
+                response = stored
+                self.replayed += 1
+                return stored, True
+            try:
+                response = await execute()
+            finally:
+                if response is None:
+                    await self.release(key)
+            if response is None:
+                return None, False
+            self.executed += 1
+            try:
+                await self.save(key, fingerprint, response)
+            except Exception:
+                # The client has its response; a retry may run the route again
+                logger.exception("Storing idempotent response failed")
+                await self.release(key)
+            return None, False
+        finally:
+            del self._inflight[key]
+            future.set_result(response)
+
+
+def error_response(status: int, detail: str) -> StoredResponse:
+    return StoredResponse(status, [("content-type", "application/json")], dump_json({"detail": detail}))
+
+
+async def read_body(receive, spool) -> Optional[str]:
+    """Copy the request body into `spool`; its SHA-256, or None if the client went away"""
+    digest = hashlib.sha256()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body = message.get("body", b"")
+        digest.update(body)
+        spool.write(body)
+        if not message.get("more_body"):
+            spool.seek(0)
+            return digest.hexdigest()
+
+
+def spooled_receive(spool, receive):
+    """`receive` for the app: the spooled body, then the client's own messages"""
+    done = [False]
+
+    async def replay():
+        if done[0]:
+            return await receive()
+        body = spool.read(BODY_CHUNK)
+        more = bool(spool.read(1))
+        if more:
+            spool.seek(-1, os.SEEK_CUR)
+        else:
+            done[0] = True
+        return {"type": "http.request", "body": body, "more_body": more}
+
+    return replay
+
+
+class IdempotencyMiddleware:
+    """Runs write requests carrying an Idempotency-Key at most once per key.
+
+    Paths matching `exempt` handle the header themselves and are passed through.
+    """
+
+    def __init__(self, app, store: IdempotencyStore, exempt: Optional[Pattern] = None):
+        self.app = app
+        self.store = store
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http" or scope["method"] not in WRITE_METHODS
+            or (self.exempt is not None and self.exempt.match(scope["path"]))
+        ):
+            return await self.app(scope, receive, send)
+        key = None
+        for name, value in scope["headers"]:
+            if name == IDEMPOTENCY_HEADER:
+                key = value.decode("latin-1")
+                break
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await self.send(send, error_response(400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"))
+
+        with tempfile.SpooledTemporaryFile(max_size=IDEMPOTENCY_SPOOL_BYTES) as spool:
+            digest = await read_body(receive, spool)
+            if digest is None:
+                return
+            query = scope.get("query_string", b"").decode("latin-1")
+            fingerprint = f"{scope['method']} {scope['path']}" + (f"?{query}" if query else "") + f" {digest}"
+            await self.handle(scope, spooled_receive(spool, receive), send, key, fingerprint)
+
+    async def handle(self, scope, receive, send, key: str, fingerprint: str):
+
+        async def execute() -> Optional[StoredResponse]:
+            start: dict = {}
+            chunks: List[bytes] = []
+            size = [0]
+
+            async def capture(message):
+                if message["type"] == "http.response.start":
+                    start.update(message)
+                elif message["type"] == "http.response.body":
+                    size[0] += len(message.get("body", b""))
+                    if size[0] <= IDEMPOTENCY_MAX_BODY:
+                        chunks.append(message.get("body", b""))
+                await send(message)
+
+            await self.app(scope, receive, capture)
+            if not start or start["status"] >= 500 or size[0] > IDEMPOTENCY_MAX_BODY:
+                return None
+            headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in start.get("headers", [])]
+            return StoredResponse(start["status"], headers, b"".join(chunks))
+
+        try:
+            response, replayed = await self.store.run(key, fingerprint, execute)
+        except KeyMismatch:
+            self.store.mismatched += 1
+            return await self.send(send, error_response(422, "Idempotency-Key was used for another request"))
+        except KeyInProgress:
+            return await self.send(send, error_response(409, "A request with this Idempotency-Key is in progress"))
+        if replayed:
+            await self.send(send, response, replayed=True)
+
+    @staticmethod
+    async def send(send, response: StoredResponse, replayed: bool = False):
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in response.headers]
+        if replayed:
+            headers.append((REPLAYED_HEADER.lower().encode(), b"true"))
+        await send({"type": "http.response.start", "status": response.status, "headers": headers})
+        await send({"type": "http.response.body", "body": response.body})
@@ -0,0 +1,77 @@
+"""
+Collision-free, time-sortable document ids.
+
+An id is a collection prefix followed by a ULID: 48 bits of Unix time in
+milliseconds then 80 random bits, as 26 Crockford base32 characters. Ids
+minted later sort after earlier ones, so `id` stays a meaningful
+tiebreaker for cursor pagination. Ids from the same millisecond are still
+ordered: the random part of the previous id is incremented. Two processes
+would need the same millisecond and the same 80 random bits to collide;
+the unique index on `id` turns even that into an error rather than a
+silent duplicate.
+
+Ids from before ULIDs, a prefix and a number (`p12`, `lot1712345678901`),
+are migrated by from_legacy and still accepted by the API.
+"""
+
+import os
+import re
+import threading
+import time
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+RANDOM_BITS = 80
+_RANDOM_MAX = (1 << RANDOM_BITS) - 1
+# A prefix and up to 14 digits: the seed ids and millisecond timestamps, all below 2**48
+LEGACY_ID = re.compile(r"([a-z]+)([0-9]{1,14})")
+
+
+class _Ulid:
+    def __init__(self):
+        self.last_ms = -1
+        self.last_random = 0
+        self.lock = threading.Lock()
+
+    def next(self) -> int:
+        with self.lock:
+            ms = time.time_ns() // 1_000_000
+            if ms > self.last_ms:
+                self.last_ms = ms
+                self.last_random = int.from_bytes(os.urandom(RANDOM_BITS // 8), "big")
+            elif self.last_random < _RANDOM_MAX:
+                # Same millisecond, or the clock went back: stay after the last id
+                self.last_random += 1
+            else:
+                self.last_ms += 1
+                self.last_random = 0
+            return (self.last_ms << RANDOM_BITS) | self.last_random
+
+
+_ulid = _Ulid()
+
+
+def encode(value: int) -> str:
+    chars = []
+    for _ in range(26):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_id(prefix: str = "") -> str:
+    """A new id, greater than every id this process minted before"""
+    return prefix + encode(_ulid.next())
+
+
+
+def from_legacy(doc_id: str) -> str:
+    """The id a legacy `<prefix><number>` id is migrated to; other ids are returned unchanged.
+
+    The number becomes the ULID time with no random bits, so p2 sorts
+    before p10, the seed ids before every minted one, and timestamp ids
+    among the ULIDs minted around the same time.
+    """
+    match = LEGACY_ID.fullmatch(doc_id)
+    if match is None:
+        return doc_id
+    return match.group(1) + encode(int(match.group(2)) << RANDOM_BITS)
@@ -0,0 +1,70 @@
+"""
+Lazy initialization, for deployments that pay for every cold start.
+
+With LAZY_INIT=1 the server starts without touching Mongo or building its
+in-memory indexes: the first request that needs the database prepares
+it, and the search, facet and similarity indexes are built when a route
+first uses them. Heavy optional modules (NumPy, Pillow) are only imported
+when first used, so a process that just serves listings never loads them.
+"""
+
+import asyncio
+import importlib
+import os
+from typing import Awaitable, Callable, Iterable, Optional
+
+LAZY_INIT = os.environ.get("LAZY_INIT", "").lower() in ("1", "true", "yes")
+
+
+class Once:
+    """Awaitable that runs `fn` the first time it is awaited, and never again.
+
+    Concurrent callers wait for the same run. If it fails, the next caller
+    tries again.
+    """
+
+    def __init__(self, fn: Callable[[], Awaitable[None]]):
+        self.fn = fn
+        self.done = False
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def __call__(self):
+        if self.done:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.done:
+                await self.fn()
+                self.done = True
+
+
+class LazyModule:
+    """Stands in for a module, importing it on first attribute access"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+class ReadyMiddleware:
+    """Awaits `ready` before passing on HTTP requests, except for `exempt` paths"""
+
+    def __init__(self, app, ready: Once, exempt: Iterable[str] = ()):
+        self.app = app
+        self.ready = ready
+        self.exempt = frozenset(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not self.ready.done and scope["path"] not in self.exempt:
+            await self.ready()
+        await self.app(scope, receive, send)
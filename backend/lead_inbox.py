@@ -0,0 +1,122 @@
+"""
+Contact-form leads: rate-limited, queued in memory, written in batches.
+
+`POST /api/messages` only validates a lead and puts it on a bounded
+queue; a background task drains the queue into the `messages`
+collection with one insert_many per batch. When the queue is full the
+endpoint answers 503 with Retry-After instead of piling up work. A
+per-client token bucket caps how many leads one address can send, so a
+spam burst is rejected before it costs a database write.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from database import Repository
+
+MESSAGES_QUEUE_SIZE = int(os.environ.get("MESSAGES_QUEUE_SIZE", "1000"))
+MESSAGES_BATCH_SIZE = int(os.environ.get("MESSAGES_BATCH_SIZE", "100"))
+MESSAGES_FLUSH_SECONDS = float(os.environ.get("MESSAGES_FLUSH_SECONDS", "1"))
+# Token bucket per client: sustained rate and burst size
+MESSAGES_PER_MINUTE = float(os.environ.get("MESSAGES_PER_MINUTE", "6"))
+MESSAGES_BURST = int(os.environ.get("MESSAGES_BURST", "3"))
+# Buckets kept; the least recently seen clients are forgotten first
+RATE_LIMIT_CLIENTS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token buckets keyed by client address"""
+
+    def __init__(self, per_minute: float = MESSAGES_PER_MINUTE, burst: int = MESSAGES_BURST,
+                 max_clients: int = RATE_LIMIT_CLIENTS):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """Take a token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[key] = [tokens, now]
+        while len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+class QueueFull(Exception):
+    """The lead queue is at capacity; the client should retry later"""
+
+
+class LeadInbox:
+    def __init__(self, repo: Repository, queue_size: int = MESSAGES_QUEUE_SIZE,
+                 batch_size: int = MESSAGES_BATCH_SIZE, interval: float = MESSAGES_FLUSH_SECONDS):
+        self.repo = repo
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending: List[dict] = []
+        self.written = 0
+        self.rejected = 0
+        self.limited = 0
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, doc: dict):
+        if len(self.pending) >= self.queue_size:
+            self.rejected += 1
+            raise QueueFull()
+        self.pending.append(doc)
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                # Stays queued until written, so a failed insert is retried
+                await self.repo.insert_many(batch)
+                del self.pending[:len(batch)]
+                self.written += len(batch)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Lead flush failed, will retry")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flush and write out what is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
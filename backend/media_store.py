@@ -0,0 +1,199 @@
+"""
+Content-addressed media store for uploaded images.
+
+Files are stored once per SHA-256 of their content under
+MEDIA_ROOT/<2 hex>/<2 hex>/<hash>, with the derived sizes next to them
+(<hash>.thumb.jpg, <hash>.card.jpg) and a small JSON sidecar holding the
+content type. Uploads are streamed to disk in chunks and never held in
+memory whole. Only images whose format Pillow recognises (ALLOWED_TYPES)
+are kept, and they are served with the detected type: the type the client
+claims is ignored, so an HTML or SVG file can never be served from the
+API's origin.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", os.path.join(os.path.dirname(__file__), "media"))
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+CHUNK_SIZE = 256 * 1024
+
+# Derived sizes generated once at upload time (max width, max height)
+VARIANTS = {
+    "thumb": (320, 240),
+    "card": (800, 600),
+}
+
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Pillow format -> content type of the images accepted and served
+ALLOWED_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class UnsupportedMedia(Exception):
+    pass
+
+
+def sniff_type(path: str) -> str:
+    """Content type of the image at `path`, from its bytes; UnsupportedMedia otherwise"""
+    # Imported here so that processes which never take an upload never load Pillow
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as img:
+            img.verify()
+            fmt = img.format
+    except (UnidentifiedImageError, OSError, ValueError, SyntaxError):
+        raise UnsupportedMedia("Not a supported image")
+    if fmt not in ALLOWED_TYPES:
+        raise UnsupportedMedia(f"Unsupported image format: {fmt}")
+    return ALLOWED_TYPES[fmt]
+
+
+class MediaStore:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _dir(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4])
+
+    def path(self, digest: str, variant: Optional[str] = None) -> str:
+        name = digest if variant is None else f"{digest}.{variant}.jpg"
+        return os.path.join(self._dir(digest), name)
+
+    def content_type(self, digest: str, variant: Optional[str] = None) -> Optional[str]:
+        """Served type of a blob; None for anything stored before uploads were sniffed"""
+        if variant is not None:
+            return "image/jpeg"
+        try:
+            with open(self.path(digest) + ".json") as f:
+                content_type = json.load(f).get("content_type")
+        except (OSError, ValueError):
+            return None
+        return content_type if content_type in ALLOWED_TYPES.values() else None
+
+    def locate(self, digest: str, variant: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """(path, content type) of a stored blob, or None if unknown"""
+        if not HASH_RE.match(digest) or (variant is not None and variant not in VARIANTS):
+            return None
+        path = self.path(digest, variant)
+        if variant is not None and not os.path.exists(path):
+            # Derived size unavailable (not an image or Pillow missing)
+            variant, path = None, self.path(digest)
+        content_type = self.content_type(digest, variant)
+        if content_type is None or not os.path.exists(path):
+            return None
+        return path, content_type
+
+    async def save(self, upload) -> Dict[str, object]:
+        """Stream an UploadFile into the store, returning its hash and available sizes"""
+        os.makedirs(self.root, exist_ok=True)
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = await upload.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > MEDIA_MAX_BYTES:
+                        raise MediaTooLarge(f"File exceeds {MEDIA_MAX_BYTES} bytes")
+                    sha.update(chunk)
+                    await run_in_threadpool(tmp.write, chunk)
+            digest = sha.hexdigest()
+            content_type = await run_in_threadpool(sniff_type, tmp_path)
+            variants = await run_in_threadpool(self._store, tmp_path, digest, content_type)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return {"hash": digest, "size": size, "content_type": content_type, "variants": variants}
+
+    def _store(self, tmp_path: str, digest: str, content_type: str) -> list:
+        final = self.path(digest)
+        if not os.path.exists(final):
+            os.makedirs(self._dir(digest), exist_ok=True)
+            os.replace(tmp_path, final)
+        # Rewritten every time, so a blob stored with an unchecked type gets the sniffed one
+        with open(final + ".json", "w") as f:
+            json.dump({"content_type": content_type}, f)
+        return self._make_variants(digest)
+
+    def _make_variants(self, digest: str) -> list:
+        from PIL import Image, ImageOps
+
+        made = [v for v in VARIANTS if os.path.exists(self.path(digest, v))]
+        if len(made) == len(VARIANTS):
+            return made
+        try:
+            with Image.open(self.path(digest)) as img:
+                img = ImageOps.exif_transpose(img).convert("RGB")
+                for variant, box in VARIANTS.items():
+                    if variant in made:
+                        continue
+                    copy = img.copy()
+                    copy.thumbnail(box)
+                    out = self.path(digest, variant)
+                    copy.save(out + ".tmp", "JPEG", quality=82, optimize=True, progressive=True)
+                    os.replace(out + ".tmp", out)
+                    made.append(variant)
+        except (OSError, ValueError):
+            pass  # decodable headers but not pixels, serve the original only
+        return made
+
+
+def parse_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=start-end` range into inclusive offsets.
+
+    Returns None when the header is absent or malformed (serve the whole
+    file) and raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition("-")
+    try:
+        start = int(start_s) if start_s else None
+        end = int(end_s) if end_s else None
+    except ValueError:
+        return None
+    if start is None:
+        if not end:
+            raise ValueError("Unsatisfiable range")
+        start, end = max(0, length - end), length - 1
+    else:
+        end = length - 1 if end is None else min(end, length - 1)
+    if start > end or start >= length:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def iter_file(path: str, start: int, end: int):
+    """Yield the inclusive byte range [start, end] of a file in chunks"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+media_store = MediaStore(MEDIA_ROOT)
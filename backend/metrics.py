@@ -0,0 +1,334 @@
+"""
+Request, database and event-loop metrics in Prometheus text format.
+
+A plain ASGI middleware times every request against its route template,
+counts requests in flight and measures response sizes. A pymongo command
+listener records how long each Mongo command took, and a background task
+measures event-loop lag. Metrics are plain counters and fixed-bucket
+histograms kept in memory, so recording costs a few dictionary and list
+operations per request, which is cheap enough to leave on in production.
+
+The sampling profiler is off by default. Once enabled, a thread samples
+the event loop's stack every few milliseconds. The samples taken while
+a slow request was running are folded into per-route stacks, which
+flamegraph.pl or speedscope can render. A sample may belong to another
+request running at the same time, so treat these as a guide to hot
+paths rather than an exact attribution.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter, deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+METRICS_PREFIX = "dialibatou"
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.5"))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+# About a minute of samples at the default interval
+PROFILE_SAMPLES_KEPT = 12000
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labelnames: Labels = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.doc = doc
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A running total, or totals read from `collect` when rendering"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: Labels = (),
+                 collect: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, doc, labelnames)
+        self.values: Dict[Labels, float] = {}
+        self.collect = collect
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        if self.collect:
+            values = self.collect()
+        else:
+            with self._lock:
+                values = dict(self.values)
+        lines = self.header()
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """A value that goes up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, labels: Labels = ()):
+        self.values[labels] = value
+
+    def add(self, amount: float, labels: Labels = ()):
+        self.inc(labels, amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Labels = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (last one is +Inf), sum]
+        self.series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(labels, (list(counts), total)) for labels, (counts, total) in self.series.items()]
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in sorted(series):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_text(names, labels + (bound,))} {cumulative}")
+            label_text = _label_text(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to serve a request, by route template.",
+    ("method", "route", "status"),
+))
+http_response_size = registry.register(Histogram(
+    "http_response_size_bytes", "Size of response bodies, by route template.",
+    ("method", "route"), SIZE_BUCKETS,
+))
+http_in_flight = registry.register(Gauge("http_requests_in_flight", "Requests being served."))
+mongo_commands = registry.register(Histogram(
+    "mongo_command_duration_seconds", "Round-trip time of Mongo commands.", ("command",),
+))
+mongo_failures = registry.register(Counter(
+    "mongo_command_failures_total", "Mongo commands that failed.", ("command",),
+))
+loop_lag = registry.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records the duration of each command; runs on the driver's threads"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_commands.observe(event.duration_micros / 1e6, (event.command_name,))
+
+    def failed(self, event):
+        mongo_commands.observe(event.duration_micros / 1e6, (event.command_name,))
+        mongo_failures.inc((event.command_name,))
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack while enabled"""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.slow_seconds = 0.0
+        self.thread_id: Optional[int] = None
+        self.samples: Deque[Tuple[float, str]] = deque(maxlen=PROFILE_SAMPLES_KEPT)
+        # Folded stacks of slow requests, per route
+        self.slow_stacks: Dict[str, StackCounter] = {}
+        self._stop: Optional[threading.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._stop is not None
+
+    def start(self, slow_ms: float):
+        self.slow_seconds = slow_ms / 1000
+        if self._stop is None:
+            self.thread_id = threading.get_ident()
+            self._stop = threading.Event()
+            threading.Thread(target=self._run, args=(self._stop,), name="profiler", daemon=True).start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def _run(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples.append((time.perf_counter(), ";".join(reversed(stack))))
+
+    def request_done(self, route: str, start: float, end: float):
+        if end - start < self.slow_seconds:
+            return
+        stacks = self.slow_stacks.setdefault(route, StackCounter())
+        for at, stack in reversed(list(self.samples)):
+            if at < start:
+                break
+            if at <= end:
+                stacks[stack] += 1
+
+    def folded(self, route: Optional[str] = None) -> str:
+        """Collapsed stacks ("frame;frame;frame count" per line) for flame graphs"""
+        total = StackCounter()
+        for name, stacks in self.slow_stacks.items():
+            if route is None or name == route:
+                total.update(stacks)
+        return "".join(f"{stack} {n}\n" for stack, n in total.most_common())
+
+    def clear(self):
+        self.samples.clear()
+        self.slow_stacks.clear()
+
+
+profiler = SamplingProfiler()
+
+
+class MetricsMiddleware:
+    """Times requests by route template ("/api/properties/{prop_id}"), not raw path"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            router = scope["app"].router
+            self._routes = {r.endpoint: r.path for r in router.routes if hasattr(r, "endpoint")}
+            route = self._routes.get(endpoint, "unmatched")
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = ["500"]
+        size = [0]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            elif message["type"] == "http.response.body":
+                size[0] += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.add(1)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.perf_counter()
+            http_in_flight.add(-1)
+            route = self._route(scope)
+            method = scope["method"]
+            http_requests.observe(end - start, (method, route, status[0]))
+            http_response_size.observe(size[0], (method, route))
+            if profiler.enabled:
+                profiler.request_done(f"{method} {route}", start, end)
+
+
+class LoopLagMonitor:
+    """Sleeps for a fixed interval and records how late it woke up"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            loop_lag.observe(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+loop_lag_monitor = LoopLagMonitor()
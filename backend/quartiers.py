@@ -0,0 +1,52 @@
+"""Reference data about the neighbourhoods (quartiers) served by the agency"""
+
+# Same mapping as RG in index.html
+REGION_BY_QUARTIER = {
+    "Almadies": "Dakar", "Almadies 2": "Dakar", "Mermoz": "Dakar", "Plateau": "Dakar",
+    "Ouakam": "Dakar", "Ngor": "Dakar", "Point E": "Dakar", "Fann": "Dakar",
+    "Sacré-Cœur": "Dakar", "Liberté": "Dakar", "Mamelles": "Dakar", "Yoff": "Dakar",
+    "Keur Massar": "Dakar", "Gorom": "Dakar",
+    "Bambilor": "Rufisque", "Tivaouane Peulh": "Rufisque", "Ndoukhoura Peulh": "Rufisque",
+    "Niagues": "Rufisque", "Niacourap": "Rufisque", "Sébikotane": "Rufisque",
+    "Diakhaye": "Rufisque", "Kounoune": "Rufisque", "Keur Ndiaye Lo": "Rufisque",
+    "Bayakh": "Rufisque",
+    "Thiès": "Thiès", "Pout": "Thiès", "Sindia": "Thiès", "Diass": "Thiès",
+    "Malikounda": "Petite Côte", "Nguérigne": "Petite Côte", "Saly": "Petite Côte",
+    "Mbour": "Petite Côte", "Toubab Dialao": "Petite Côte", "Ndayane": "Petite Côte",
+    "Yène": "Petite Côte",
+}
+
+DEFAULT_REGION = "Sénégal"
+
+# Centroid (lat, lon) of each quartier, same table as COORDS in index.html
+COORDS = {
+    "Almadies": (14.745, -17.522), "Almadies 2": (14.742, -17.518),
+    "Mermoz": (14.707, -17.473), "Plateau": (14.669, -17.438), "Ouakam": (14.724, -17.491),
+    "Ngor": (14.748, -17.518), "Point E": (14.697, -17.465), "Fann": (14.694, -17.457),
+    "Sacré-Cœur": (14.715, -17.458), "Liberté": (14.705, -17.450),
+    "Mamelles": (14.732, -17.505), "Yoff": (14.755, -17.478), "Keur Massar": (14.768, -17.317),
+    "Gorom": (14.746, -17.332), "Bambilor": (14.732, -17.215),
+    "Tivaouane Peulh": (14.770, -17.295), "Ndoukhoura Peulh": (14.760, -17.280),
+    "Niagues": (14.710, -17.230), "Niacourap": (14.680, -17.240),
+    "Sébikotane": (14.740, -17.140), "Diakhaye": (14.735, -17.310),
+    "Kounoune": (14.760, -17.260), "Keur Ndiaye Lo": (14.750, -17.270),
+    "Bayakh": (14.785, -17.240), "Thiès": (14.789, -16.926), "Pout": (14.767, -17.059),
+    "Sindia": (14.581, -17.053), "Diass": (14.670, -17.070), "Malikounda": (14.470, -17.010),
+    "Nguérigne": (14.450, -16.980), "Saly": (14.448, -17.015), "Mbour": (14.419, -16.964),
+    "Toubab Dialao": (14.630, -17.170), "Ndayane": (14.640, -17.130),
+    "Yène": (14.660, -17.170),
+}
+
+
+def region_of(quartier: str) -> str:
+    """Region of a quartier, same fallback as gR() in index.html"""
+    return REGION_BY_QUARTIER.get(quartier, DEFAULT_REGION)
+
+
+def quartiers_in(region: str) -> list:
+    return [nb for nb, rg in REGION_BY_QUARTIER.items() if rg == region]
+
+
+def centroid(place: str):
+    """(lat, lon) of a quartier or lot location, or None if unknown"""
+    return COORDS.get(place)
@@ -0,0 +1,154 @@
+"""
+Listing query helpers: filters, sort keys and keyset (cursor) pagination.
+
+A cursor is the (sort value, id) pair of the last item of a page, so the
+next page is a plain index range scan instead of a skip over everything
+already returned.
+"""
+
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from quartiers import quartiers_in
+
+MAX_PAGE_SIZE = 100
+
+# Public sort key -> document field
+SORT_FIELDS = {
+    "id": "id",
+    "pr": "pr",
+    "su": "su",
+    "be": "be",
+    "vi": "vi",
+}
+
+# Fields a client may pick with `fields=`; `id` is always returned
+PROPERTY_FIELDS = (
+    "ti", "de", "ty", "tr", "pr", "nb", "su", "ro", "be", "ba", "fe", "im", "vd", "ft", "vi", "ag", "geo",
+)
+LOT_FIELDS = ("loc", "zone", "lots", "dispo", "su", "pr", "st", "fe", "geo")
+# What a listing card shows (view=card); `im` is cut to the first image
+PROPERTY_CARD_FIELDS = ("ti", "pr", "nb", "ty", "tr", "su", "be", "ft", "im")
+LOT_CARD_FIELDS = ("loc", "zone", "lots", "dispo", "pr", "st")
+VIEWS = ("card",)
+
+
+class QueryError(ValueError):
+    """Raised for malformed sort keys, cursors or field selections"""
+
+
+def build_property_filter(
+    ty: Optional[str] = None,
+    tr: Optional[str] = None,
+    nb: Optional[str] = None,
+    rg: Optional[str] = None,
+    pr_min: Optional[int] = None,
+    pr_max: Optional[int] = None,
+    su_min: Optional[int] = None,
+    su_max: Optional[int] = None,
+    be_min: Optional[int] = None,
+    ft: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """Translate listing filters into a Mongo query"""
+    query: Dict[str, Any] = {}
+    if ty:
+        query["ty"] = ty
+    if tr:
+        query["tr"] = tr
+    if nb:
+        query["nb"] = nb
+    elif rg:
+        query["nb"] = {"$in": quartiers_in(rg)}
+    if ft is not None:
+        query["ft"] = ft
+    for field, low, high in (("pr", pr_min, pr_max), ("su", su_min, su_max), ("be", be_min, None)):
+        bounds = {}
+        if low is not None:
+            bounds["$gte"] = low
+        if high is not None:
+            bounds["$lte"] = high
+        if bounds:
+            query[field] = bounds
+    return query
+
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Evaluate a filter from build_property_filter against an in-memory document"""
+    for field, cond in query.items():
+        value = doc.get(field)
+        if isinstance(cond, dict):
+            if "$in" in cond and value not in cond["$in"]:
+                return False
+            if "$gte" in cond and (value is None or value < cond["$gte"]):
+                return False
+            if "$lte" in cond and (value is None or value > cond["$lte"]):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def parse_sort(sort: Optional[str]) -> Tuple[str, int]:
+    """Parse `pr` / `-pr` style sort keys into (field, direction)"""
+    key = sort or "id"
+    direction = -1 if key.startswith("-") else 1
+    field = SORT_FIELDS.get(key.lstrip("-"))
+    if field is None:
+        raise QueryError(f"Unknown sort key: {key}")
+    return field, direction
+
+
+def sort_spec(field: str, direction: int) -> List[Tuple[str, int]]:
+    """Sort on the requested field with `id` as a unique tie-breaker"""
+    if field == "id":
+        return [("id", direction)]
+    return [(field, direction), ("id", direction)]
+
+
+def encode_cursor(doc: Dict[str, Any], field: str) -> str:
+    raw = json.dumps([doc.get(field), doc["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise QueryError("Invalid cursor")
+    if not isinstance(last_id, str):
+        raise QueryError("Invalid cursor")
+    return value, last_id
+
+
+def after_cursor(cursor: str, field: str, direction: int) -> Dict[str, Any]:
+    """Query clause selecting the documents that come after the cursor"""
+    value, last_id = decode_cursor(cursor)
+    op = "$gt" if direction == 1 else "$lt"
+    if field == "id":
+        return {"id": {op: last_id}}
+    return {"$or": [{field: {op: value}}, {field: value, "id": {op: last_id}}]}
+
+
+def build_projection(
+    fields: Optional[str], view: Optional[str], allowed: Tuple[str, ...],
+    card: Tuple[str, ...], required: Tuple[str, ...] = (),
+) -> Optional[Dict[str, Any]]:
+    """Mongo projection for `fields=a,b` and/or `view=card`; None means whole documents.
+
+    `required` fields are always included, e.g. the sort key a cursor is built from.
+    """
+    if not fields and view is None:
+        return None
+    if view is not None and view not in VIEWS:
+        raise QueryError(f"Unknown view: {view}")
+    picked = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    for name in picked:
+        if name not in allowed:
+            raise QueryError(f"Unknown field: {name}")
+    projection: Dict[str, Any] = {"_id": 0, "id": 1}
+    projection.update({f: 1 for f in (*(card if view == "card" else ()), *picked, *required)})
+    if view == "card" and "im" in card and "im" not in picked:
+        projection["im"] = {"$slice": 1}
+    return projection
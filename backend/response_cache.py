@@ -0,0 +1,164 @@
+"""
+In-process cache of pre-serialized JSON responses for catalogue reads.
+
+Entries are keyed by collection, the collection's version at load time and
+a route-specific key (path + canonical query string). A write bumps the
+version, so stale entries are never served, and the repository listener
+also drops them right away to free memory. Each entry carries a strong
+ETag derived from its bytes, used for If-None-Match -> 304 handling.
+Compressed copies are made on first request for each encoding and kept
+with the entry, so a popular listing is compressed once per version.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+from database import Change, Repository
+from encoding import COMPRESS_MIN_BYTES, choose_encoding, compress, dump_json
+
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Clients and CDNs may keep a copy but must revalidate it with the ETag
+CATALOGUE_CACHE_CONTROL = "public, no-cache"
+# Larger bodies are compressed off the event loop
+COMPRESS_IN_THREAD_BYTES = 256 * 1024
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Content coding -> compressed body
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.body) + sum(len(b) for b in self.encoded.values())
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Each encoding is a different representation, with its own strong ETag"""
+        return self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+class ResponseCache:
+    """Bounded LRU of serialized responses, limited by entry count and total bytes"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, int, str], CachedResponse]" = OrderedDict()
+
+    def get(self, collection: str, version: int, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get((collection, version, key))
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((collection, version, key))
+        self.hits += 1
+        return entry
+
+    def put(self, collection: str, version: int, key: str, entry: CachedResponse):
+        if len(entry.body) > self.max_bytes:
+            return
+        old = self._entries.pop((collection, version, key), None)
+        if old is not None:
+            self.size -= old.nbytes
+        self._entries[(collection, version, key)] = entry
+        self.size += entry.nbytes
+        self._shrink()
+
+    def add_encoding(self, collection: str, version: int, key: str, entry: CachedResponse,
+                     encoding: str, body: bytes):
+        """Keep a compressed copy of entry, counting it against the byte limit"""
+        if encoding in entry.encoded:
+            return
+        entry.encoded[encoding] = body
+        if self._entries.get((collection, version, key)) is entry:
+            self.size += len(body)
+            self._shrink()
+
+    def _shrink(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def invalidate(self, collection: str):
+        for k in [k for k in self._entries if k[0] == collection]:
+            self.size -= self._entries.pop(k).nbytes
+
+    def on_change(self, change: Change):
+        self.invalidate(change.collection)
+
+
+def cache_key(request: Request) -> str:
+    """Path plus the query string with parameters in a canonical order"""
+    params = sorted(request.query_params.multi_items())
+    return request.url.path + "?" + "&".join(f"{k}={v}" for k, v in params)
+
+
+async def cached_json(
+    request: Request,
+    cache: ResponseCache,
+    repo: Repository,
+    loader: Callable[[], Awaitable[Tuple[object, Dict[str, str]]]],
+) -> Response:
+    """Serve a JSON read of `repo` from the cache, loading it on a miss.
+
+    `loader` returns the data and any extra response headers. The result is
+    only stored if no write to the collection happened while it was loading.
+    """
+    key = cache_key(request)
+    version = repo.version
+    entry = cache.get(repo.name, version, key)
+    if entry is None:
+        data, headers = await loader()
+        body = dump_json(data)
+        entry = CachedResponse(body, make_etag(body), headers)
+        if repo.version == version:
+            cache.put(repo.name, version, key, entry)
+
+    encoding = None
+    if len(entry.body) >= COMPRESS_MIN_BYTES:
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+    etag = entry.etag_for(encoding)
+    headers = {
+        "ETag": etag, "Cache-Control": CATALOGUE_CACHE_CONTROL, "Vary": "Accept-Encoding", **entry.headers,
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    body = entry.encoded.get(encoding)
+    if body is None:
+        if len(entry.body) >= COMPRESS_IN_THREAD_BYTES:
+            body = await run_in_threadpool(compress, entry.body, encoding)
+        else:
+            body = compress(entry.body, encoding)
+        cache.add_encoding(repo.name, version, key, entry, encoding, body)
+    headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def json_response(data, status_code: int = 200) -> Response:
+    """JSON response for data that is already valid, skipping response_model checks"""
+    return Response(content=dump_json(data), status_code=status_code, media_type="application/json")
+
+
+response_cache = ResponseCache()
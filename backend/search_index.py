@@ -0,0 +1,382 @@
+"""
+In-process full-text index over the property catalogue.
+
+Text from `ti`, `de`, `nb` and `fe` is accent-folded ("Sacré-Cœur" ->
+"sacre coeur"), split into words, stripped of French stop words and
+reduced with a light French stemmer. Ranking is BM25 with per-field
+weights. The last query word also matches as a prefix for type-ahead.
+
+Each term keeps its postings as {doc: impact}, where the impact is the
+BM25 term-frequency part (without idf), which makes writes cheap dict
+updates. On first query after a change a term's postings are frozen into
+NumPy arrays sorted by impact. A query first scores only the union of
+each term's best postings, which is exact as soon as no document outside
+that set can enter the top-k (a threshold-algorithm bound). When the
+scores are too flat for the bound to hold, every posting is accumulated
+into a score vector instead, with frequent terms added as whole vectors.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from database import ChangeListener
+from lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# Field -> weight in the term frequency (BM25F-style)
+FIELD_WEIGHTS = {"ti": 3.0, "nb": 2.0, "fe": 1.5, "de": 1.0}
+
+# Fields returned with each hit so type-ahead needs no extra lookup
+SUMMARY_FIELDS = ("ti", "nb", "ty", "tr", "pr")
+
+K1 = 1.2
+B = 0.75
+# Prefix expansion considers at most this many vocabulary words...
+PREFIX_SCAN = 256
+# ...and keeps the most frequent of them
+PREFIX_TERMS = 16
+# Rebuild impacts when the average document length drifts this much
+AVGDL_DRIFT = 0.25
+# Postings depths tried before falling back to scoring every posting
+PRUNE_DEPTHS = (128,)
+# Terms in at least 1/DENSE_RATIO of the documents are added as whole
+# vectors, kept for the DENSE_CACHE_SIZE most recently queried terms
+DENSE_RATIO = 32
+DENSE_CACHE_SIZE = 64
+
+STOP_WORDS = frozenset("""
+a au aux avec ce ces dans de des du en et la le les leur lui ma mais me
+meme mes moi mon ne nos notre nous ou par pas pour qu que qui sa se ses
+son sur ta te tes toi ton tu un une vos votre vous d l j m n s t y c
+est sont plus tres
+""".split())
+
+# Light French stemmer suffixes, longest first, applied after plural removal
+SUFFIXES = (
+    "issement", "atrice", "ateur", "ation", "ement", "ance", "ence", "euse",
+    "able", "ique", "isme", "iste", "ite", "ive", "if",
+)
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+LIGATURES = str.maketrans({"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae", "ß": "ss"})
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents and ligatures"""
+    text = text.translate(LIGATURES).lower()
+    if text.isascii():
+        return text
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("aux") and len(word) > 4:
+        word = word[:-3] + "al"
+    elif word[-1] in "sx":
+        word = word[:-1]
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    while len(word) > 3 and word[-1] == "e":
+        word = word[:-1]
+    return word
+
+
+def analyze(text: str) -> List[Tuple[str, str]]:
+    """(folded word, stem) pairs of the indexable words in text"""
+    return [(w, stem(w)) for w in WORD_RE.findall(fold(text)) if w not in STOP_WORDS]
+
+
+def field_text(doc: dict, field: str) -> str:
+    value = doc.get(field) or ""
+    return " ".join(value) if isinstance(value, list) else str(value)
+
+
+class SearchIndex(ChangeListener):
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ids: List[Optional[str]] = []
+        self.slot: Dict[str, int] = {}
+        self.free: List[int] = []
+        self.summaries: List[Optional[dict]] = []
+        self.doc_tf: List[Optional[Dict[str, float]]] = []
+        self.doc_len: List[float] = []
+        self.doc_words: List[Optional[set]] = []
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self._arrays_cache: Dict[str, Tuple[np.ndarray, ...]] = {}
+        self._dense_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.word_stem: Dict[str, str] = {}
+        self.word_df: Dict[str, int] = {}
+        self.vocab: List[str] = []
+        self.total_len = 0.0
+        self.avgdl = 1.0
+        self._bulk = False
+        self._tiebreak = ()
+
+    def __len__(self):
+        return len(self.slot)
+
+    # ---- writes ----
+
+    def rebuild(self, docs: List[dict]):
+        self.clear()
+        self._bulk = True
+        try:
+            for doc in docs:
+                self.add(doc)
+        finally:
+            self._bulk = False
+        self._reweight()
+
+    def add(self, doc: dict):
+        """Index a document, replacing any previous version with the same id"""
+        doc_id = doc["id"]
+        if doc_id in self.slot:
+            self.remove(doc_id)
+        tf: Dict[str, float] = defaultdict(float)
+        words = set()
+        length = 0.0
+        for field, weight in FIELD_WEIGHTS.items():
+            for word, term in analyze(field_text(doc, field)):
+                tf[term] += weight
+                length += weight
+                if word not in words:
+                    words.add(word)
+                    self._add_word(word, term)
+
+        if self.free:
+            i = self.free.pop()
+            self.ids[i], self.doc_tf[i], self.doc_len[i], self.doc_words[i] = doc_id, dict(tf), length, words
+            self.summaries[i] = {f: doc.get(f) for f in SUMMARY_FIELDS}
+        else:
+            i = len(self.ids)
+            self.ids.append(doc_id)
+            self.doc_tf.append(dict(tf))
+            self.doc_len.append(length)
+            self.doc_words.append(words)
+            self.summaries.append({f: doc.get(f) for f in SUMMARY_FIELDS})
+        self.slot[doc_id] = i
+        self.total_len += length
+        for term, freq in tf.items():
+            self.postings.setdefault(term, {})[i] = self._impact(freq, length)
+            self._touch(term)
+        self._check_drift()
+
+    def remove(self, doc_id: str) -> bool:
+        i = self.slot.pop(doc_id, None)
+        if i is None:
+            return False
+        for term in self.doc_tf[i]:
+            plist = self.postings[term]
+            del plist[i]
+            if not plist:
+                del self.postings[term]
+            self._touch(term)
+        for word in self.doc_words[i]:
+            self._remove_word(word)
+        self.total_len -= self.doc_len[i]
+        self.ids[i] = self.doc_tf[i] = self.doc_words[i] = self.summaries[i] = None
+        self.doc_len[i] = 0.0
+        self.free.append(i)
+        self._check_drift()
+        return True
+
+    def _add_word(self, word: str, term: str):
+        if word in self.word_df:
+            self.word_df[word] += 1
+        else:
+            self.word_df[word] = 1
+            self.word_stem[word] = term
+            insort(self.vocab, word)
+
+    def _remove_word(self, word: str):
+        self.word_df[word] -= 1
+        if self.word_df[word] == 0:
+            del self.word_df[word], self.word_stem[word]
+            del self.vocab[bisect_left(self.vocab, word)]
+
+    def _touch(self, term: str):
+        self._arrays_cache.pop(term, None)
+        self._dense_cache.pop(term, None)
+
+    def _impact(self, freq: float, length: float) -> float:
+        return freq * (K1 + 1) / (freq + K1 * (1 - B + B * length / self.avgdl))
+
+    def _check_drift(self):
+        if self._bulk or not self.slot:
+            return
+        current = self.total_len / len(self.slot) or 1.0
+        if abs(current - self.avgdl) / self.avgdl > AVGDL_DRIFT:
+            self._reweight()
+
+    def _reweight(self):
+        """Recompute every impact against the current average document length"""
+        self.avgdl = (self.total_len / len(self.slot) if self.slot else 0.0) or 1.0
+        for term, plist in self.postings.items():
+            for i in plist:
+                plist[i] = self._impact(self.doc_tf[i][term], self.doc_len[i])
+        self._arrays_cache.clear()
+        self._dense_cache.clear()
+
+    # ---- reads ----
+
+    def _idf(self, term: str) -> float:
+        df = len(self.postings[term])
+        return math.log(1 + (len(self.slot) - df + 0.5) / (df + 0.5))
+
+    def _arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """A term's postings frozen into arrays, cached until the term changes.
+
+        Returns (slots, impacts) ordered by decreasing impact, for walking
+        the best matches first, and (slots, impacts) ordered by slot, for
+        looking up any document's impact with a binary search.
+        """
+        arrays = self._arrays_cache.get(term)
+        if arrays is None:
+            plist = self.postings[term]
+            slots = np.fromiter(plist.keys(), dtype=np.int64, count=len(plist))
+            impacts = np.fromiter(plist.values(), dtype=np.float64, count=len(plist))
+            by_impact = np.argsort(-impacts, kind="stable")
+            by_slot = np.argsort(slots, kind="stable")
+            arrays = (slots[by_impact], impacts[by_impact], slots[by_slot], impacts[by_slot])
+            self._arrays_cache[term] = arrays
+        return arrays
+
+    def _dense(self, term: str) -> np.ndarray:
+        """Impacts of a frequent term as a vector over every slot (small LRU)"""
+        vector = self._dense_cache.get(term)
+        if vector is None:
+            _, _, slots, impacts = self._arrays(term)
+            vector = np.zeros(len(self.ids), dtype=np.float32)
+            vector[slots] = impacts
+            self._dense_cache[term] = vector
+            if len(self._dense_cache) > DENSE_CACHE_SIZE:
+                self._dense_cache.popitem(last=False)
+        else:
+            self._dense_cache.move_to_end(term)
+        return vector
+
+    def _score(self, candidates: np.ndarray, weighted: List[List[Tuple[float, str]]]) -> np.ndarray:
+        """Exact BM25 scores of the candidate slots"""
+        scores = np.zeros(len(candidates))
+        for group in weighted:
+            best = np.zeros(len(candidates))
+            for idf, term in group:
+                _, _, slots, impacts = self._arrays(term)
+                pos = np.minimum(np.searchsorted(slots, candidates), len(slots) - 1)
+                hit = slots[pos] == candidates
+                best = np.maximum(best, np.where(hit, impacts[pos] * idf, 0.0))
+            scores += best
+        return scores
+
+    def _top_pruned(self, weighted, limit: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Exact top-k from the terms' best postings only, or None if not provable.
+
+        Scores the union of every term's `depth` best postings. A document
+        outside that union scores at most `bound`; once the k-th best
+        candidate reaches the bound, the result is exact.
+        """
+        terms = [(idf, t, len(self.postings[t])) for group in weighted for idf, t in group]
+        longest = max(df for _, _, df in terms)
+        for depth in PRUNE_DEPTHS:
+            candidates = np.unique(np.concatenate([self._arrays(t)[0][:depth] for _, t, _ in terms]))
+            scores = self._score(candidates, weighted)
+            k = min(limit, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            if depth >= longest:
+                return candidates[top], scores[top]
+            bound = sum(
+                max((idf * self._arrays(t)[1][depth] if depth < len(self.postings[t]) else 0.0)
+                    for idf, t in group)
+                for group in weighted
+            )
+            if k == limit and scores[top[-1]] >= bound:
+                return candidates[top], scores[top]
+        return None
+
+    def _top_dense(self, weighted, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k by accumulating every posting into a score vector"""
+        n = len(self.ids)
+        scores = np.zeros(n, dtype=np.float32)
+        for group in weighted:
+            best = scores if len(group) == 1 else np.zeros(n, dtype=np.float32)
+            for idf, term in group:
+                if len(self.postings[term]) * DENSE_RATIO >= n:
+                    contribution = self._dense(term) * np.float32(idf)
+                    if best is scores:
+                        best += contribution
+                    else:
+                        np.maximum(best, contribution, out=best)
+                else:
+                    _, _, slots, impacts = self._arrays(term)
+                    values = (impacts * idf).astype(np.float32)
+                    if best is scores:
+                        best[slots] += values
+                    else:
+                        best[slots] = np.maximum(best[slots], values)
+            if best is not scores:
+                scores += best
+        k = min(limit, int(np.count_nonzero(scores)))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        # Break ties by slot: selection degrades badly on long runs of equal scores
+        if len(self._tiebreak) != n:
+            self._tiebreak = np.arange(n) * 1e-9
+        top = np.argpartition(self._tiebreak - scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top].astype(np.float64)
+
+    def _expand(self, prefix: str) -> List[str]:
+        """Stems of the most frequent vocabulary words starting with prefix"""
+        start = bisect_left(self.vocab, prefix)
+        words = []
+        for word in self.vocab[start:start + PREFIX_SCAN]:
+            if not word.startswith(prefix):
+                break
+            words.append(word)
+        words.sort(key=self.word_df.__getitem__, reverse=True)
+        return [self.word_stem[w] for w in words[:PREFIX_TERMS]]
+
+    def search(self, q: str, limit: int = 10, prefix: bool = True) -> List[dict]:
+        """Top `limit` documents for q by BM25, best first"""
+        tokens = analyze(q)
+        if not tokens or not self.slot:
+            return []
+        # Each query word is a group of terms (several for a prefix); a
+        # document's score for a group is its best term in that group.
+        groups: List[List[str]] = []
+        for n, (word, term) in enumerate(tokens):
+            terms = {term} if term in self.postings else set()
+            if prefix and n == len(tokens) - 1 and not q[-1:].isspace():
+                terms.update(self._expand(word))
+            if terms:
+                groups.append(sorted(terms))
+        if not groups:
+            return []
+
+        weighted = [[(self._idf(t), t) for t in terms] for terms in groups]
+        found = self._top_pruned(weighted, limit)
+        top_slots, top_scores = found if found is not None else self._top_dense(weighted, limit)
+
+        return [
+            {"id": self.ids[i], "score": round(float(s), 4), **self.summaries[i]}
+            for i, s in zip(top_slots.tolist(), top_scores.tolist())
+        ]
+
+
+search_index = SearchIndex()
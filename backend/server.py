@@ -1,34 +1,151 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import Depends, FastAPI, HTTPException, UploadFile, File, Header, Path, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional
-from pymongo import MongoClient
-from bson import ObjectId
+from pydantic import AfterValidator, BaseModel, Field, ValidationError, field_validator, model_validator
+from typing import Annotated, List, Optional, Union
+import math
 import os
-import base64
+import re
+import secrets
+import zlib
 from datetime import datetime, timezone
 
+from analytics import GROUP_FIELDS, lot_analytics, property_analytics
+from catalog_sync import plan_sync
+from catalog_transfer import CatalogImporter, export_docs, gunzip
+from cluster import CHANGE_FEED, WORKERS, ChangeFeed, mongo_lock
+from database import (
+    MESSAGE_PROJECTION, DuplicateId, LotKeyMismatch, LotNotFound, NotEnoughLots,
+    database, messages_repo, properties_repo, lots_repo,
+)
+from encoding import NDJSON_MEDIA_TYPE, choose_encoding, compressed, ndjson_chunks
+from event_hub import event_hub
+from facets import facet_index
+from geo import (
+    CLUSTER_MAX_ZOOM, backfill as backfill_geo, bbox_query, cluster, distance_m, marker,
+    marker_projection, near_query, resolve_point,
+)
+from idempotency import REPLAYED_HEADER, IdempotencyMiddleware, IdempotencyStore
+from ids import from_legacy, new_id
+from lazy import LAZY_INIT, Once, ReadyMiddleware
+from metrics import (
+    PROFILE_SLOW_MS, Counter, Gauge, MetricsMiddleware, loop_lag_monitor, profiler, registry,
+)
+from lead_inbox import MESSAGES_FLUSH_SECONDS, LeadInbox, QueueFull, RateLimiter
+from media_store import MediaTooLarge, UnsupportedMedia, iter_file, media_store, parse_range
+from response_cache import cached_json, json_response, response_cache
+from search_index import search_index
+from similarity import similarity_index
+from view_counter import ViewCounter
+from queries import (
+    LOT_CARD_FIELDS, LOT_FIELDS, MAX_PAGE_SIZE, PROPERTY_CARD_FIELDS, PROPERTY_FIELDS, QueryError,
+    after_cursor, build_projection, build_property_filter, encode_cursor, matches, parse_sort, sort_spec,
+)
+
 app = FastAPI(title="DIALIBATOU BTP API")
 
+properties_repo.subscribe(response_cache.on_change)
+lots_repo.subscribe(response_cache.on_change)
+properties_repo.subscribe(search_index.on_change)
+properties_repo.subscribe(facet_index.on_change)
+properties_repo.subscribe(similarity_index.on_change)
+properties_repo.subscribe(property_analytics.on_change)
+lots_repo.subscribe(lot_analytics.on_change)
+properties_repo.subscribe(event_hub.on_change)
+lots_repo.subscribe(event_hub.on_change)
+
+# With several workers, writes are replayed in the others' caches and indexes
+change_feed = ChangeFeed(database, [properties_repo, lots_repo])
+properties_repo.subscribe(change_feed.on_change)
+lots_repo.subscribe(change_feed.on_change)
+
+# Views each worker writes out are added to the others' totals
+view_counter = ViewCounter(
+    properties_repo, on_flush=lambda counts: change_feed.publish_counts("properties", "vi", counts),
+)
+properties_repo.subscribe(view_counter.on_change)
+change_feed.subscribe_counts(lambda collection, field, counts: view_counter.add_remote(counts))
+
+lead_inbox = LeadInbox(messages_repo)
+message_limiter = RateLimiter()
+
+idempotency_store = IdempotencyStore(database)
+
+registry.register(Counter(
+    "response_cache_lookups_total", "Response cache lookups, by result.", ("result",),
+    collect=lambda: {("hit",): response_cache.hits, ("miss",): response_cache.misses},
+))
+registry.register(Gauge(
+    "response_cache_hit_ratio", "Share of response cache lookups served from the cache.",
+    collect=lambda: {(): response_cache.hits / max(1, response_cache.hits + response_cache.misses)},
+))
+registry.register(Gauge(
+    "response_cache_bytes", "Bytes held by the response cache.",
+    collect=lambda: {(): response_cache.size},
+))
+registry.register(Gauge(
+    "collection_version", "Write counter of each collection.", ("collection",),
+    collect=lambda: {(repo.name,): repo.version for repo in (properties_repo, lots_repo)},
+))
+registry.register(Gauge(
+    "views_pending", "Views counted but not yet written to the database.",
+    collect=lambda: {(): sum(view_counter.pending.values())},
+))
+registry.register(Gauge(
+    "event_subscribers", "Clients connected to /api/events.",
+    collect=lambda: {(): len(event_hub.subscribers)},
+))
+registry.register(Counter(
+    "event_evictions_total", "Event clients dropped for falling behind.",
+    collect=lambda: {(): event_hub.evictions},
+))
+registry.register(Gauge(
+    "messages_queued", "Contact messages waiting to be written.",
+    collect=lambda: {(): len(lead_inbox.pending)},
+))
+registry.register(Counter(
+    "messages_total", "Contact messages, by outcome.", ("result",),
+    collect=lambda: {
+        ("written",): lead_inbox.written, ("queue_full",): lead_inbox.rejected,
+        ("rate_limited",): lead_inbox.limited,
+    },
+))
+registry.register(Counter(
+    "change_feed_records_total", "Changes shared with other workers, by direction.", ("direction",),
+    collect=lambda: {("published",): change_feed.published, ("applied",): change_feed.applied},
+))
+
+registry.register(Counter(
+    "idempotent_requests_total", "Write requests with an Idempotency-Key, by outcome.", ("result",),
+    collect=lambda: {
+        ("executed",): idempotency_store.executed, ("replayed",): idempotency_store.replayed,
+        ("mismatched",): idempotency_store.mismatched,
+    },
+))
+
+# Inside the metrics and CORS middlewares, so replays are timed and get CORS headers.
+# Lot reservations keep their keys on the lot itself, atomically with the stock change.
+app.add_middleware(
+    IdempotencyMiddleware, store=idempotency_store, exempt=re.compile(r"/api/lots/[^/]+/(reserve|release)$"),
+)
+
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", REPLAYED_HEADER],
 )
 
-# MongoDB connection
-MONGO_URL = os.environ.get("MONGO_URL")
-DB_NAME = os.environ.get("DB_NAME", "dialibatou")
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
+# Pydantic Models
 
-# Collections
-properties_col = db["properties"]
-lots_col = db["lots"]
+# A property or lot id; legacy ids (p12, lot3) are read as the ids they were migrated to
+DocId = Annotated[str, AfterValidator(from_legacy)]
+PathId = Annotated[DocId, Path()]
 
-# Pydantic Models
 class Agent(BaseModel):
     na: str = "Mame Cheikh Ndiaye"
     ph: str = "+221 77 709 61 44"
@@ -38,6 +155,19 @@ class Video(BaseModel):
     src: str
     name: Optional[str] = None
 
+class GeoPoint(BaseModel):
+    """GeoJSON point; coordinates are [longitude, latitude]"""
+    type: str = Field("Point", pattern="^Point$")
+    coordinates: List[float] = Field(..., min_length=2, max_length=2)
+
+    @field_validator("coordinates")
+    @classmethod
+    def check_range(cls, v):
+        lon, lat = v
+        if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+            raise ValueError("coordinates must be [longitude, latitude]")
+        return v
+
 class PropertyBase(BaseModel):
     ti: str
     de: Optional[str] = ""
@@ -55,6 +185,14 @@ class PropertyBase(BaseModel):
     ft: bool = False
     vi: int = 0
     ag: Agent = Agent()
+    geo: Optional[GeoPoint] = None
+    geo_src: Optional[str] = None
+
+    @model_validator(mode="after")
+    def default_geo(self):
+        point, self.geo_src = resolve_point(self.geo.model_dump() if self.geo else None, self.nb)
+        self.geo = GeoPoint(**point) if point else None
+        return self
 
 class PropertyCreate(PropertyBase):
     pass
@@ -62,6 +200,25 @@ class PropertyCreate(PropertyBase):
 class PropertyResponse(PropertyBase):
     id: str
 
+class PropertyCard(BaseModel):
+    """Listing card (view=card); with `fields=` only the requested fields are present"""
+    id: str
+    ti: Optional[str] = None
+    pr: Optional[int] = None
+    nb: Optional[str] = None
+    ty: Optional[str] = None
+    tr: Optional[str] = None
+    su: Optional[int] = None
+    be: Optional[int] = None
+    ft: Optional[bool] = None
+    im: Optional[List[str]] = None
+
+class PropertySyncItem(BaseModel):
+    # Chosen by the client, for new items too, so that a retried sync is a no-op
+    id: DocId = Field(..., min_length=1, max_length=64)
+    h: Optional[str] = None
+    data: Optional[PropertyCreate] = None
+
 class LotBase(BaseModel):
     loc: str
     zone: str = ""
@@ -71,6 +228,14 @@ class LotBase(BaseModel):
     pr: int = 0
     st: str = "Disponible"
     fe: List[str] = []
+    geo: Optional[GeoPoint] = None
+    geo_src: Optional[str] = None
+
+    @model_validator(mode="after")
+    def default_geo(self):
+        point, self.geo_src = resolve_point(self.geo.model_dump() if self.geo else None, self.loc)
+        self.geo = GeoPoint(**point) if point else None
+        return self
 
 class LotCreate(LotBase):
     pass
@@ -78,6 +243,53 @@ class LotCreate(LotBase):
 class LotResponse(LotBase):
     id: str
 
+class LotCard(BaseModel):
+    """Lot summary (view=card); with `fields=` only the requested fields are present"""
+    id: str
+    loc: Optional[str] = None
+    zone: Optional[str] = None
+    lots: Optional[int] = None
+    dispo: Optional[int] = None
+    pr: Optional[int] = None
+    st: Optional[str] = None
+
+class MessageCreate(BaseModel):
+    """Contact form lead, optionally about one property (pid) or lot"""
+    na: str = Field(..., min_length=1, max_length=100)
+    em: str = Field("", max_length=200, pattern=r"^$|^[^@\s]+@[^@\s]+\.[^@\s]+$")
+    ph: str = Field("", max_length=30)
+    su: str = Field("", max_length=100)
+    ms: str = Field(..., min_length=1, max_length=5000)
+    pid: Optional[DocId] = Field(None, max_length=64)
+    lot: Optional[DocId] = Field(None, max_length=64)
+
+    @model_validator(mode="after")
+    def reachable(self):
+        if not self.em and not self.ph:
+            raise ValueError("An email address or phone number is required")
+        return self
+
+class LotStockChange(BaseModel):
+    n: int = Field(1, ge=1, le=1000)
+
+class LotReservation(BaseModel):
+    lot: LotResponse
+    n: int
+    replayed: bool = False
+
+class LotSyncItem(BaseModel):
+    id: DocId = Field(..., min_length=1, max_length=64)
+    h: Optional[str] = None
+    data: Optional[LotCreate] = None
+
+class SyncResult(BaseModel):
+    inserted: List[str]
+    updated: List[str]
+    deleted: List[str]
+    unchanged: int
+    missing: List[str]
+    stale: List[str]
+
 # Default properties data
 DEFAULT_PROPERTIES = [
     {"id":"p1","ti":"Luxueux Appartement Vue Mer Almadies","de":"Superbe appartement de standing avec vue imprenable sur l'océan. Résidence sécurisée, finitions haut de gamme. 3 chambres, terrasse 25m².","ty":"Appartement","tr":"Vente","pr":185000000,"nb":"Almadies","su":180,"ro":5,"be":3,"ba":2,"fe":["Piscine","Parking","Sécurité 24h","Vue mer"],"im":["https://images.unsplash.com/photo-1600596542815-ffad4c1539a9?w=800","https://images.unsplash.com/photo-1600607687939-ce8a6c25118c?w=800"],"ft":True,"vi":342,"ag":{"na":"Mame Cheikh Ndiaye","ph":"+221 77 709 61 44"}},
@@ -105,154 +317,839 @@ DEFAULT_LOTS = [
     {"id":"lot8","loc":"Sindia","zone":"Village","lots":70,"dispo":55,"su":350,"pr":4000000,"st":"Disponible","fe":["Délibération","Eau"]},
 ]
 
-def init_database():
+# The seed ids predate ULIDs: store them as prepare_database migrates them
+DEFAULT_PROPERTIES = [dict(d, id=from_legacy(d["id"])) for d in DEFAULT_PROPERTIES]
+DEFAULT_LOTS = [dict(d, id=from_legacy(d["id"])) for d in DEFAULT_LOTS]
+
+# Bump when indexes, default data or backfills change: the next start applies them once
+SCHEMA_VERSION = 6
+
+async def init_database():
     """Initialize database with default data if empty"""
-    if properties_col.count_documents({}) == 0:
-        properties_col.insert_many(DEFAULT_PROPERTIES)
-    if lots_col.count_documents({}) == 0:
-        lots_col.insert_many(DEFAULT_LOTS)
+    if await properties_repo.count() == 0:
+        await properties_repo.replace_all(DEFAULT_PROPERTIES)
+    if await lots_repo.count() == 0:
+        await lots_repo.replace_all(DEFAULT_LOTS)
+
+async def prepare_database():
+    """Indexes, default data and backfills, once per SCHEMA_VERSION.
+
+    After the first start this costs one read of the version marker.
+    """
+    await database.connect()
+    if (await database.marker("schema") or 0) >= SCHEMA_VERSION:
+        return
+    # One worker prepares; the others wait, then find the marker set
+    async with mongo_lock(database, "init"):
+        if (await database.marker("schema") or 0) >= SCHEMA_VERSION:
+            return
+        indexed = [await repo.ensure_indexes() for repo in (properties_repo, lots_repo, messages_repo)]
+        await idempotency_store.ensure_indexes()
+        await init_database()
+        # Legacy ids sorted as strings: p10 before p2, and all of them after the ULIDs
+        await properties_repo.rename_ids(from_legacy, [(messages_repo, "pid")])
+        await lots_repo.rename_ids(from_legacy, [(messages_repo, "lot")])
+        await backfill_geo(properties_repo, "nb")
+        await backfill_geo(lots_repo, "loc")
+        # Hashes written before dispo and st left the hashed content
+        await lots_repo.refresh_hashes()
+        # A unique index that stored duplicates prevented: leave the marker, so it is tried again
+        if all(indexed):
+            await database.set_marker("schema", SCHEMA_VERSION)
+
+async def start_services():
+    await prepare_database()
+    if CHANGE_FEED:
+        await change_feed.start()
+    view_counter.start()
+    lead_inbox.start()
+
+async def load_indexes():
+    """Build the search, facet, similarity and analytics indexes and view totals from the database"""
+    await database_ready()
+    all_properties = await load_snapshot(properties_repo)
+    all_lots = await load_snapshot(lots_repo)
+    search_index.rebuild(all_properties)
+    facet_index.rebuild(all_properties)
+    similarity_index.rebuild(all_properties)
+    property_analytics.rebuild(all_properties)
+    lot_analytics.rebuild(all_lots)
+    view_counter.load(all_properties)
+
+async def load_snapshot(repo):
+    while True:
+        version = repo.version
+        docs = await repo.find_all()
+        # A write during the load reached the indexes before this older snapshot: load again
+        if repo.version == version:
+            return docs
+
+# Awaited by every request but health and metrics; done at startup unless LAZY_INIT
+database_ready = Once(start_services)
+# Awaited by the routes that use the in-memory indexes
+indexes_ready = Once(load_indexes)
+
+app.add_middleware(ReadyMiddleware, ready=database_ready, exempt=("/api/health", "/api/metrics"))
 
 @app.on_event("startup")
 async def startup():
-    init_database()
+    loop_lag_monitor.start()
+    if PROFILE_SLOW_MS > 0:
+        profiler.start(PROFILE_SLOW_MS)
+    if not LAZY_INIT:
+        await database_ready()
+        await indexes_ready()
+
+@app.on_event("shutdown")
+async def shutdown():
+    profiler.stop()
+    await loop_lag_monitor.stop()
+    await view_counter.stop()
+    await lead_inbox.stop()
+    await change_feed.stop()
+    await database.close()
+
+# Bearer token for admin routes (leads, metrics, profiler); unset, they are closed
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin access is not configured")
+    if not authorization or not secrets.compare_digest(authorization.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
 
 # Health check
 @app.get("/api/health")
 async def health():
     return {"status": "ok", "service": "DIALIBATOU BTP API"}
 
+async def iter_list(docs: List[dict]):
+    for doc in docs:
+        yield doc
+
+def ndjson_response(request: Request, docs) -> StreamingResponse:
+    """Stream documents as NDJSON, compressed if the client accepts it"""
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(
+        compressed(ndjson_chunks(docs), encoding), media_type=NDJSON_MEDIA_TYPE, headers=headers,
+    )
+
+# ============ METRICS ============
+
+@app.get("/api/metrics", dependencies=[Depends(require_admin)])
+async def metrics():
+    """Metrics in Prometheus text format; scrape with the admin token as bearer"""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.post("/api/metrics/profiler", dependencies=[Depends(require_admin)])
+async def start_profiler(slow_ms: float = Query(200, ge=0)):
+    """Start sampling; requests slower than slow_ms keep their stacks"""
+    profiler.start(slow_ms)
+    return {"enabled": True, "slow_ms": slow_ms}
+
+@app.delete("/api/metrics/profiler", dependencies=[Depends(require_admin)])
+async def stop_profiler():
+    """Stop sampling and drop what was collected"""
+    profiler.stop()
+    profiler.clear()
+    return {"enabled": False}
+
+@app.get("/api/metrics/profile", dependencies=[Depends(require_admin)])
+async def get_profile(route: Optional[str] = None):
+    """Folded stacks of slow requests, for flamegraph.pl or speedscope.
+
+    `route` narrows them to one route, e.g. "GET /api/properties".
+    """
+    return Response(profiler.folded(route), media_type="text/plain; charset=utf-8")
+
 # ============ PROPERTIES ENDPOINTS ============
 
-@app.get("/api/properties", response_model=List[PropertyResponse])
-async def get_properties():
-    """Get all properties"""
-    props = list(properties_col.find({}, {"_id": 0}))
-    return props
+@app.get("/api/properties", response_model=Union[List[PropertyResponse], List[PropertyCard]])
+async def get_properties(
+    request: Request,
+    ty: Optional[str] = None,
+    tr: Optional[str] = None,
+    nb: Optional[str] = None,
+    rg: Optional[str] = None,
+    pr_min: Optional[int] = Query(None, ge=0),
+    pr_max: Optional[int] = Query(None, ge=0),
+    su_min: Optional[int] = Query(None, ge=0),
+    su_max: Optional[int] = Query(None, ge=0),
+    be_min: Optional[int] = Query(None, ge=0),
+    ft: Optional[bool] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+):
+    """Get properties, optionally filtered, sorted and paginated.
+
+    Without `limit` every matching property is returned. With `limit` the
+    next page's cursor is sent in the `X-Next-Cursor` header. Clients
+    accepting application/x-ndjson get one property per line; without
+    `limit` it is streamed from the database cursor without building the
+    list in memory, with `limit` it pages exactly as the JSON response.
+
+    `view=card` returns only what a listing card shows, with the first
+    image; `fields=ti,pr,...` picks fields (added to the card's if both
+    are given). The projection is applied by Mongo, so descriptions,
+    image lists and videos are never read for a card list.
+    """
+    query = build_property_filter(ty, tr, nb, rg, pr_min, pr_max, su_min, su_max, be_min, ft)
+    try:
+        field, direction = parse_sort(sort)
+        if cursor:
+            query.update(after_cursor(cursor, field, direction))
+        projection = build_projection(
+            fields, view, PROPERTY_FIELDS, PROPERTY_CARD_FIELDS, (field,) if limit is not None else ()
+        )
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        if limit is None:
+            docs = properties_repo.iter_docs(
+                query, sort_spec(field, direction) if sort else None, projection=projection
+            )
+            return ndjson_response(request, docs)
+        # A page is at most MAX_PAGE_SIZE rows: read it whole to know whether another follows
+        props = await properties_repo.find_page(query, sort_spec(field, direction), limit + 1, projection)
+        response = ndjson_response(request, iter_list(props[:limit]))
+        if len(props) > limit:
+            response.headers["X-Next-Cursor"] = encode_cursor(props[limit - 1], field)
+        return response
+
+    async def load():
+        if limit is None:
+            if sort is None:
+                return await properties_repo.find_all(query, projection), {}
+            return await properties_repo.find_page(query, sort_spec(field, direction), projection=projection), {}
+        props = await properties_repo.find_page(query, sort_spec(field, direction), limit + 1, projection)
+        if len(props) <= limit:
+            return props, {}
+        props = props[:limit]
+        return props, {"X-Next-Cursor": encode_cursor(props[-1], field)}
+
+    return await cached_json(request, response_cache, properties_repo, load)
+
+# ============ MAP ============
+
+GEO_REPOS = {"properties": properties_repo, "lots": lots_repo}
+GEO_MAX_MARKERS = 5000
+
+async def nearby(collection: str, lat: float, lon: float, radius_km: float, limit: int) -> dict:
+    docs = await GEO_REPOS[collection].find_fields(
+        near_query(lat, lon, radius_km * 1000), marker_projection(collection), limit
+    )
+    markers = []
+    for doc in docs:
+        m = marker(doc, collection)
+        m["km"] = round(distance_m((lat, lon), (m["lat"], m["lon"])) / 1000, 2)
+        markers.append(m)
+    return {"center": {"lat": lat, "lon": lon}, "radius_km": radius_km, "results": markers}
+
+@app.get("/api/properties/near")
+async def properties_near(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(5, gt=0, le=200),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Properties within radius_km of a point, nearest first"""
+    return await nearby("properties", lat, lon, radius_km, limit)
+
+@app.get("/api/lots/near")
+async def lots_near(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(5, gt=0, le=200),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Lots within radius_km of a point, nearest first"""
+    return await nearby("lots", lat, lon, radius_km, limit)
+
+@app.get("/api/geo/bbox")
+async def markers_in_bbox(
+    bbox: str = Query(..., description="west,south,east,north"),
+    zoom: int = Query(CLUSTER_MAX_ZOOM, ge=0, le=22),
+    collections: str = "properties,lots",
+):
+    """Map markers inside a viewport, clustered below zoom 15"""
+    try:
+        west, south, east, north = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be west,south,east,north")
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise HTTPException(status_code=400, detail="bbox must be west,south,east,north")
+    names = [c for c in collections.split(",") if c]
+    unknown = [c for c in names if c not in GEO_REPOS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {unknown[0]}")
+
+    markers, truncated = [], False
+    for name in names:
+        docs = await GEO_REPOS[name].find_fields(
+            bbox_query(west, south, east, north), marker_projection(name), GEO_MAX_MARKERS + 1
+        )
+        truncated = truncated or len(docs) > GEO_MAX_MARKERS
+        markers.extend(marker(doc, name) for doc in docs[:GEO_MAX_MARKERS])
+    return {"zoom": zoom, "truncated": truncated, "results": cluster(markers, zoom)}
 
 @app.get("/api/properties/{prop_id}", response_model=PropertyResponse)
-async def get_property(prop_id: str):
+async def get_property(prop_id: PathId, request: Request):
     """Get a single property by ID"""
-    prop = properties_col.find_one({"id": prop_id}, {"_id": 0})
-    if not prop:
-        raise HTTPException(status_code=404, detail="Property not found")
-    return prop
+    async def load():
+        prop = await properties_repo.find_one(prop_id)
+        if not prop:
+            raise HTTPException(status_code=404, detail="Property not found")
+        return prop, {}
+
+    return await cached_json(request, response_cache, properties_repo, load)
 
 @app.post("/api/properties", response_model=PropertyResponse)
 async def create_property(prop: PropertyCreate):
     """Create a new property"""
     prop_dict = prop.model_dump()
-    prop_dict["id"] = f"p{int(datetime.now(timezone.utc).timestamp() * 1000)}"
-    properties_col.insert_one(prop_dict)
-    return PropertyResponse(**prop_dict)
+    prop_dict["id"] = new_id("p")
+    try:
+        await properties_repo.insert(prop_dict)
+    except DuplicateId:
+        raise HTTPException(status_code=409, detail="Property id already exists")
+    return json_response(prop_dict)
 
 @app.put("/api/properties/{prop_id}", response_model=PropertyResponse)
-async def update_property(prop_id: str, prop: PropertyCreate):
+async def update_property(prop_id: PathId, prop: PropertyCreate):
     """Update an existing property"""
     prop_dict = prop.model_dump()
     prop_dict["id"] = prop_id
-    result = properties_col.update_one({"id": prop_id}, {"$set": prop_dict})
-    if result.matched_count == 0:
+    stored = await properties_repo.update(prop_id, prop_dict)
+    if stored is None:
         raise HTTPException(status_code=404, detail="Property not found")
-    return PropertyResponse(**prop_dict)
+    return json_response(stored)
 
 @app.delete("/api/properties/{prop_id}")
-async def delete_property(prop_id: str):
+async def delete_property(prop_id: PathId):
     """Delete a property"""
-    result = properties_col.delete_one({"id": prop_id})
-    if result.deleted_count == 0:
+    if not await properties_repo.delete(prop_id):
         raise HTTPException(status_code=404, detail="Property not found")
     return {"message": "Property deleted successfully"}
 
+@app.get("/api/properties/{prop_id}/similar")
+async def similar_properties(prop_id: PathId, limit: int = Query(6, ge=1, le=24)):
+    """Most similar listings: same kind of property, quartier, price range and amenities"""
+    await indexes_ready()
+    results = similarity_index.similar(prop_id, limit)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Property not found")
+    return {"id": prop_id, "results": results}
+
+# ============ EVENTS ============
+
+@app.get("/api/events")
+async def events(last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events stream of catalogue changes.
+
+    Each `change` event carries the collection, op, id, new collection
+    version, the changed field names and new card values. A `reset` event
+    means the client fell behind, or reconnected to another worker, and
+    should refetch.
+    """
+    return StreamingResponse(
+        event_hub.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ============ VIEWS ============
+
+@app.post("/api/properties/{prop_id}/view")
+async def record_view(prop_id: PathId):
+    """Count a page view; written to the database in batches"""
+    await indexes_ready()
+    views = view_counter.hit(prop_id)
+    if views is None:
+        raise HTTPException(status_code=404, detail="Property not found")
+    return {"id": prop_id, "vi": views}
+
+@app.get("/api/most-viewed")
+async def most_viewed(limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE)):
+    """Most viewed properties, including views not yet written out"""
+    await indexes_ready()
+    return view_counter.most_viewed(limit)
+
+# ============ SEARCH ============
+
+@app.get("/api/search")
+async def search_properties(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(10, ge=1, le=50),
+    prefix: bool = True,
+):
+    """Full-text search over title, description, quartier and features.
+
+    Accent-insensitive, stemmed and ranked by BM25; with `prefix` the last
+    word also matches as a prefix, for type-ahead.
+    """
+    await indexes_ready()
+    return {"q": q, "results": search_index.search(q, limit, prefix)}
+
+# ============ FACETS ============
+
+@app.get("/api/facets")
+async def get_facets(
+    request: Request,
+    ty: Optional[str] = None,
+    tr: Optional[str] = None,
+    nb: Optional[str] = None,
+    rg: Optional[str] = None,
+    pr_min: Optional[int] = Query(None, ge=0),
+    pr_max: Optional[int] = Query(None, ge=0),
+    su_min: Optional[int] = Query(None, ge=0),
+    su_max: Optional[int] = Query(None, ge=0),
+    be_min: Optional[int] = Query(None, ge=0),
+    ft: Optional[bool] = None,
+):
+    """Counts and min/median/max price per quartier, region, type, transaction and feature.
+
+    Accepts the same filters as GET /api/properties.
+    """
+    query = build_property_filter(ty, tr, nb, rg, pr_min, pr_max, su_min, su_max, be_min, ft)
+    await indexes_ready()
+
+    async def load():
+        if not query:
+            return facet_index.facets(), {}
+        return facet_index.facets(lambda row: matches(row, query)), {}
+
+    return await cached_json(request, response_cache, properties_repo, load)
+
+# ============ ANALYTICS ============
+
+@app.get("/api/analytics/price-per-m2")
+async def get_price_per_m2(
+    request: Request,
+    by: str = "nb,ty,tr",
+    ty: Optional[str] = None,
+    tr: Optional[str] = None,
+    nb: Optional[str] = None,
+    rg: Optional[str] = None,
+):
+    """Price per m² (count, mean, std, p10..p90) per group of listings.
+
+    `by` lists the fields to group by, among nb, rg, ty and tr; empty for
+    one market-wide row. ty, tr, nb and rg restrict to one value each.
+    """
+    group_by = [f for f in by.split(",") if f]
+    unknown = [f for f in group_by if f not in GROUP_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot group by: {', '.join(unknown)}")
+    filters = {f: v for f, v in (("ty", ty), ("tr", tr), ("nb", nb), ("rg", rg)) if v is not None}
+    await indexes_ready()
+
+    async def load():
+        return {"by": group_by, "segments": property_analytics.price_per_m2(group_by, filters)}, {}
+
+    return await cached_json(request, response_cache, properties_repo, load)
+
+@app.get("/api/analytics/lots")
+async def get_lot_absorption(request: Request):
+    """Lots offered, available and sold per location, with the absorption rate"""
+    await indexes_ready()
+
+    async def load():
+        return {"locations": lot_analytics.absorption()}, {}
+
+    return await cached_json(request, response_cache, lots_repo, load)
+
 # ============ LOTS ENDPOINTS ============
 
-@app.get("/api/lots", response_model=List[LotResponse])
-async def get_lots():
-    """Get all lots"""
-    lots = list(lots_col.find({}, {"_id": 0}))
-    return lots
+@app.get("/api/lots", response_model=Union[List[LotResponse], List[LotCard]])
+async def get_lots(request: Request, fields: Optional[str] = None, view: Optional[str] = None):
+    """Get all lots; `view=card` and `fields=` work as for properties"""
+    try:
+        projection = build_projection(fields, view, LOT_FIELDS, LOT_CARD_FIELDS)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def load():
+        return await lots_repo.find_all(projection=projection), {}
+
+    return await cached_json(request, response_cache, lots_repo, load)
 
 @app.get("/api/lots/{lot_id}", response_model=LotResponse)
-async def get_lot(lot_id: str):
+async def get_lot(lot_id: PathId, request: Request):
     """Get a single lot by ID"""
-    lot = lots_col.find_one({"id": lot_id}, {"_id": 0})
-    if not lot:
-        raise HTTPException(status_code=404, detail="Lot not found")
-    return lot
+    async def load():
+        lot = await lots_repo.find_one(lot_id)
+        if not lot:
+            raise HTTPException(status_code=404, detail="Lot not found")
+        return lot, {}
+
+    return await cached_json(request, response_cache, lots_repo, load)
 
 @app.post("/api/lots", response_model=LotResponse)
 async def create_lot(lot: LotCreate):
     """Create a new lot"""
     lot_dict = lot.model_dump()
-    lot_dict["id"] = f"lot{int(datetime.now(timezone.utc).timestamp() * 1000)}"
-    lots_col.insert_one(lot_dict)
-    return LotResponse(**lot_dict)
+    lot_dict["id"] = new_id("lot")
+    try:
+        await lots_repo.insert(lot_dict)
+    except DuplicateId:
+        raise HTTPException(status_code=409, detail="Lot id already exists")
+    return json_response(lot_dict)
 
 @app.put("/api/lots/{lot_id}", response_model=LotResponse)
-async def update_lot(lot_id: str, lot: LotCreate):
-    """Update an existing lot"""
+async def update_lot(lot_id: PathId, lot: LotCreate):
+    """Update an existing lot; dispo and st are kept, they change through reserve/release"""
     lot_dict = lot.model_dump()
     lot_dict["id"] = lot_id
-    result = lots_col.update_one({"id": lot_id}, {"$set": lot_dict})
-    if result.matched_count == 0:
+    stored = await lots_repo.update(lot_id, lot_dict)
+    if stored is None:
         raise HTTPException(status_code=404, detail="Lot not found")
-    return LotResponse(**lot_dict)
+    return json_response(stored)
 
 @app.delete("/api/lots/{lot_id}")
-async def delete_lot(lot_id: str):
+async def delete_lot(lot_id: PathId):
     """Delete a lot"""
-    result = lots_col.delete_one({"id": lot_id})
-    if result.deleted_count == 0:
+    if not await lots_repo.delete(lot_id):
         raise HTTPException(status_code=404, detail="Lot not found")
     return {"message": "Lot deleted successfully"}
 
+# ============ LOT RESERVATIONS ============
+
+@app.post("/api/lots/{lot_id}/reserve", response_model=LotReservation)
+async def reserve_lot(
+    lot_id: PathId,
+    change: Optional[LotStockChange] = None,
+    idempotency_key: Optional[str] = Header(None, max_length=200),
+):
+    """Atomically reserve n plots of a lot (409 if fewer are available).
+
+    Retries with the same Idempotency-Key header are not applied twice and
+    get the first attempt's result back; reusing a key with another n is 422.
+    """
+    n = (change or LotStockChange()).n
+    try:
+        lot, replayed = await lots_repo.reserve(lot_id, n, idempotency_key)
+    except LotNotFound:
+        raise HTTPException(status_code=404, detail="Lot not found")
+    except NotEnoughLots:
+        raise HTTPException(status_code=409, detail="Not enough plots available")
+    except LotKeyMismatch:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was used with another n")
+    return {"lot": lot, "n": n, "replayed": replayed}
+
+@app.post("/api/lots/{lot_id}/release", response_model=LotReservation)
+async def release_lot(
+    lot_id: PathId,
+    change: Optional[LotStockChange] = None,
+    idempotency_key: Optional[str] = Header(None, max_length=200),
+):
+    """Atomically give back n plots of a lot (409 if it would exceed the total)"""
+    n = (change or LotStockChange()).n
+    try:
+        lot, replayed = await lots_repo.release(lot_id, n, idempotency_key)
+    except LotNotFound:
+        raise HTTPException(status_code=404, detail="Lot not found")
+    except NotEnoughLots:
+        raise HTTPException(status_code=409, detail="Release would exceed the lot's total")
+    except LotKeyMismatch:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was used with another n")
+    return {"lot": lot, "n": n, "replayed": replayed}
+
 # ============ BULK OPERATIONS ============
 
 @app.post("/api/properties/bulk")
 async def bulk_update_properties(properties: List[PropertyCreate]):
     """Replace all properties with new list"""
-    properties_col.delete_many({})
     props_list = []
-    for i, prop in enumerate(properties):
+    for prop in properties:
         prop_dict = prop.model_dump()
-        prop_dict["id"] = f"p{int(datetime.now(timezone.utc).timestamp() * 1000) + i}"
+        prop_dict["id"] = new_id("p")
         props_list.append(prop_dict)
-    if props_list:
-        properties_col.insert_many(props_list)
+    await properties_repo.replace_all(props_list)
     return {"message": f"{len(props_list)} properties saved"}
 
 @app.post("/api/lots/bulk")
 async def bulk_update_lots(lots: List[LotCreate]):
     """Replace all lots with new list"""
-    lots_col.delete_many({})
     lots_list = []
-    for i, lot in enumerate(lots):
+    for lot in lots:
         lot_dict = lot.model_dump()
-        lot_dict["id"] = f"lot{int(datetime.now(timezone.utc).timestamp() * 1000) + i}"
+        lot_dict["id"] = new_id("lot")
         lots_list.append(lot_dict)
-    if lots_list:
-        lots_col.insert_many(lots_list)
+    await lots_repo.replace_all(lots_list)
     return {"message": f"{len(lots_list)} lots saved"}
 
+# ============ INCREMENTAL SYNC ============
+
+async def sync_collection(repo, items) -> dict:
+    server_hashes = await repo.hashes()
+    plan = plan_sync(
+        server_hashes,
+        [{"id": it.id, "h": it.h, "data": it.data.model_dump() if it.data else None} for it in items],
+    )
+    await repo.apply_sync(plan.upserts, plan.deleted, set(server_hashes))
+    return plan.summary()
+
+@app.get("/api/sync/properties")
+async def get_properties_manifest():
+    """Map of property id to content hash, to compute what to sync"""
+    return await properties_repo.hashes()
+
+@app.post("/api/sync/properties", response_model=SyncResult)
+async def sync_properties(items: List[PropertySyncItem]):
+    """Make the stored properties match the given list, writing only what changed.
+
+    Every item has an id chosen by the client, new ones included.
+    Unchanged items may be sent as {id, h} without data; stored ids absent
+    from the list are deleted.
+    """
+    return await sync_collection(properties_repo, items)
+
+@app.get("/api/sync/lots")
+async def get_lots_manifest():
+    """Map of lot id to content hash, to compute what to sync"""
+    return await lots_repo.hashes()
+
+@app.post("/api/sync/lots", response_model=SyncResult)
+async def sync_lots(items: List[LotSyncItem]):
+    """Make the stored lots match the given list, writing only what changed"""
+    return await sync_collection(lots_repo, items)
+
 @app.post("/api/reset")
 async def reset_database():
     """Reset database to default data"""
-    properties_col.delete_many({})
-    lots_col.delete_many({})
-    properties_col.insert_many(DEFAULT_PROPERTIES)
-    lots_col.insert_many(DEFAULT_LOTS)
+    await properties_repo.replace_all(DEFAULT_PROPERTIES)
+    await lots_repo.replace_all(DEFAULT_LOTS)
+    await backfill_geo(properties_repo, "nb")
+    await backfill_geo(lots_repo, "loc")
     return {"message": "Database reset to default data"}
 
+# ============ EXPORT / IMPORT ============
+
+TRANSFER_REPOS = {"properties": properties_repo, "lots": lots_repo}
+catalog_importer = CatalogImporter(TRANSFER_REPOS)
+
+def minted_ids(prefix: str):
+    """Id factory for new items of one request, same scheme as the create routes"""
+    return lambda i: new_id(prefix)
+
+def import_validator(model, mint_id):
+    """Validate one imported doc with `model`, keeping its id or minting one"""
+    minted = [0]
+
+    def validate(doc: dict) -> dict:
+        doc_id = doc.get("id")
+        if doc_id is not None and (not isinstance(doc_id, str) or not doc_id):
+            raise ValueError("id must be a non-empty string")
+        try:
+            data = model.model_validate(doc).model_dump()
+        except ValidationError as e:
+            first = e.errors()[0]
+            raise ValueError(f"{'.'.join(str(p) for p in first['loc'])}: {first['msg']}")
+        if doc_id is None:
+            doc_id = mint_id(minted[0])
+            minted[0] += 1
+        data["id"] = from_legacy(doc_id)
+        return data
+
+    return validate
+
+@app.get("/api/export")
+async def export_catalogue(request: Request, collection: Optional[str] = None):
+    """Stream properties and lots as NDJSON, one {collection, doc} per line"""
+    if collection is not None and collection not in TRANSFER_REPOS:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {collection}")
+    repos = TRANSFER_REPOS if collection is None else {collection: TRANSFER_REPOS[collection]}
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    response = ndjson_response(request, export_docs(repos))
+    response.headers["Content-Disposition"] = f'attachment; filename="dialibatou-{stamp}.ndjson"'
+    return response
+
+@app.post("/api/import")
+async def import_catalogue(
+    request: Request,
+    collection: Optional[str] = None,
+    import_id: Optional[str] = Query(None, alias="id", min_length=1, max_length=64),
+):
+    """Upsert properties and lots from an NDJSON body, as written by /api/export.
+
+    Lines are validated one by one; invalid lines are reported and skipped.
+    With `collection`, lines may also be bare documents of that collection.
+    A gzip body (Content-Encoding: gzip) is decompressed on the fly.
+    Progress of a running import is at GET /api/import/{id}, where `id`
+    may be chosen by the client.
+    """
+    if collection is not None and collection not in TRANSFER_REPOS:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {collection}")
+    report = catalog_importer.start(import_id or new_id("import"))
+    validators = {
+        "properties": import_validator(PropertyCreate, minted_ids("p")),
+        "lots": import_validator(LotCreate, minted_ids("lot")),
+    }
+    chunks = request.stream()
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        chunks = gunzip(chunks)
+    try:
+        await catalog_importer.run(chunks, report, validators, collection)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Invalid gzip body")
+    return report.summary()
+
+@app.get("/api/import/{import_id}")
+async def get_import(import_id: str):
+    """Progress and errors of a recent import"""
+    report = catalog_importer.reports.get(import_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return report.summary()
+
+# ============ MESSAGES ============
+
+# Behind a reverse proxy the client address comes from X-Forwarded-For
+TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS", "").lower() in ("1", "true", "yes")
+
+def client_address(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+@app.post("/api/messages", status_code=202)
+async def create_message(msg: MessageCreate, request: Request):
+    """Queue a contact message; it is written to the database within a second or so"""
+    client = client_address(request)
+    wait = message_limiter.acquire(client)
+    if wait:
+        lead_inbox.limited += 1
+        raise HTTPException(
+            status_code=429, detail="Too many messages", headers={"Retry-After": str(math.ceil(wait))}
+        )
+    if msg.pid and not await properties_repo.find_one(msg.pid):
+        raise HTTPException(status_code=404, detail="Property not found")
+    if msg.lot and not await lots_repo.find_one(msg.lot):
+        raise HTTPException(status_code=404, detail="Lot not found")
+    now = datetime.now(timezone.utc)
+    doc = msg.model_dump()
+    doc.update(id=new_id("msg"), at=now.isoformat(), ip=client, rd=False)
+    try:
+        lead_inbox.submit(doc)
+    except QueueFull:
+        raise HTTPException(
+            status_code=503, detail="Inbox busy, try again shortly",
+            headers={"Retry-After": str(math.ceil(MESSAGES_FLUSH_SECONDS))},
+        )
+    return {"id": doc["id"], "queued": True}
+
+@app.get("/api/messages", dependencies=[Depends(require_admin)])
+async def list_messages(
+    pid: Optional[DocId] = None,
+    lot: Optional[DocId] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Messages, newest first; the next page's cursor is in `next`. Needs the admin token"""
+    # Write out queued messages first so a reader sees every accepted one
+    await lead_inbox.flush()
+    query = {}
+    if pid:
+        query["pid"] = pid
+    if lot:
+        query["lot"] = lot
+    if cursor:
+        try:
+            query.update(after_cursor(cursor, "at", -1))
+        except QueryError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    docs = await messages_repo.find_page(query, sort_spec("at", -1), limit + 1, MESSAGE_PROJECTION)
+    next_cursor = encode_cursor(docs[limit - 1], "at") if len(docs) > limit else None
+    return json_response({"results": docs[:limit], "next": next_cursor})
+
+@app.post("/api/messages/{msg_id}/read", dependencies=[Depends(require_admin)])
+async def mark_message_read(msg_id: str, read: bool = True):
+    """Mark a message read (or unread with read=false). Needs the admin token"""
+    await lead_inbox.flush()
+    msg = await messages_repo.find_one(msg_id)
+    if msg is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    stored = await messages_repo.update(msg_id, dict(msg, rd=read))
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    stored.pop("ip", None)
+    return json_response(stored)
+
+@app.delete("/api/messages/{msg_id}", dependencies=[Depends(require_admin)])
+async def delete_message(msg_id: str):
+    """Delete a message. Needs the admin token"""
+    await lead_inbox.flush()
+    if not await messages_repo.delete(msg_id):
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {"message": "Message deleted successfully"}
+
 # ============ IMAGE UPLOAD ============
 
+# Prefix for media URLs when the API is served from another origin than the site
+MEDIA_BASE_URL = os.environ.get("MEDIA_BASE_URL", "")
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
 @app.post("/api/upload")
 async def upload_image(file: UploadFile = File(...)):
-    """Upload an image and return base64 data URL"""
-    contents = await file.read()
-    base64_data = base64.b64encode(contents).decode('utf-8')
-    content_type = file.content_type or "image/jpeg"
-    data_url = f"data:{content_type};base64,{base64_data}"
-    return {"url": data_url, "filename": file.filename}
+    """Upload an image (JPEG, PNG, GIF or WebP) into the media store and return its URLs"""
+    try:
+        info = await media_store.save(file)
+    except MediaTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedMedia as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    url = f"{MEDIA_BASE_URL}/api/media/{info['hash']}"
+    return {
+        "url": url,
+        "filename": file.filename,
+        "hash": info["hash"],
+        "sizes": {variant: f"{url}?size={variant}" for variant in info["variants"]},
+    }
+
+@app.get("/api/media/{digest}")
+async def get_media(digest: str, request: Request, size: Optional[str] = None):
+    """Serve a stored image (or one of its derived sizes) with Range support"""
+    found = media_store.locate(digest, size)
+    if not found:
+        raise HTTPException(status_code=404, detail="Media not found")
+    path, content_type = found
+    etag = f'"{digest}{"." + size if size else ""}"'
+    headers = {
+        "Cache-Control": MEDIA_CACHE_CONTROL, "ETag": etag, "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff", "Content-Disposition": "inline",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    length = os.path.getsize(path)
+    try:
+        byte_range = parse_range(request.headers.get("range"), length)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{length}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(iter_file(path, 0, length - 1), media_type=content_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file(path, start, end), status_code=206, media_type=content_type, headers=headers)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    port = int(os.environ.get("PORT", "8001"))
+    if WORKERS > 1:
+        # Each worker imports the app and connects to Mongo in its own startup
+        uvicorn.run("server:app", host="0.0.0.0", port=port, workers=WORKERS,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
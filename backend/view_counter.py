@@ -0,0 +1,108 @@
+"""
+Write-behind view counter for properties.
+
+Page views are added to an in-memory table and flushed to Mongo every few
+seconds as a single bulk write of `$inc` operations, so tracking
+popularity costs one batched write per interval rather than one per hit.
+The same table, seeded from the stored `vi` at startup, answers "most
+viewed" queries without touching the database. With several workers each
+flushed batch is also handed to `on_flush`, which shares it through the
+change feed, and the other workers add it to their totals with
+`add_remote`, so every worker answers with the same counts.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+from typing import Callable, Dict, List, Optional
+
+from database import Change, Repository
+
+VIEW_FLUSH_SECONDS = float(os.environ.get("VIEW_FLUSH_SECONDS", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    def __init__(self, repo: Repository, field: str = "vi", interval: float = VIEW_FLUSH_SECONDS,
+                 on_flush: Optional[Callable[[Dict[str, int]], None]] = None):
+        self.repo = repo
+        self.field = field
+        self.interval = interval
+        self.on_flush = on_flush
+        self.totals: Dict[str, int] = {}
+        self.pending: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def load(self, docs: List[dict]):
+        self.totals = {d["id"]: (d.get(self.field) or 0) + self.pending.get(d["id"], 0) for d in docs}
+
+    def on_change(self, change: Change):
+        if change.op == "replace":
+            docs = change.docs or []
+            ids = {d["id"] for d in docs}
+            self.pending = {k: n for k, n in self.pending.items() if k in ids}
+            self.load(docs)
+        elif change.op == "delete":
+            self.totals.pop(change.id, None)
+            self.pending.pop(change.id, None)
+        elif change.doc is not None:
+            stored = change.doc.get(self.field) or 0
+            self.totals[change.id] = stored + self.pending.get(change.id, 0)
+
+    def hit(self, doc_id: str) -> Optional[int]:
+        """Count one view; returns the new total, or None for an unknown id"""
+        if doc_id not in self.totals:
+            return None
+        self.totals[doc_id] += 1
+        self.pending[doc_id] = self.pending.get(doc_id, 0) + 1
+        return self.totals[doc_id]
+
+    def add_remote(self, counts: Dict[str, int]):
+        """Views another worker counted and already wrote out"""
+        for doc_id, n in counts.items():
+            if doc_id in self.totals:
+                self.totals[doc_id] += n
+
+    def most_viewed(self, limit: int) -> List[dict]:
+        top = heapq.nlargest(limit, self.totals.items(), key=lambda item: item[1])
+        return [{"id": doc_id, self.field: views} for doc_id, views in top]
+
+    async def flush(self):
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        try:
+            await self.repo.increment(self.field, batch)
+        except Exception:
+            # Keep the counts for the next flush rather than losing them
+            for doc_id, n in batch.items():
+                if doc_id in self.totals:
+                    self.pending[doc_id] = self.pending.get(doc_id, 0) + n
+            raise
+        if self.on_flush is not None:
+            self.on_flush(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("View counter flush failed, will retry")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic flush and write out what is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -248,6 +248,251 @@ class BackendAPITester:
         
         return success
 
+    def test_paginated_properties(self):
+        """Test filtered, sorted cursor pagination of properties"""
+        seen = []
+        cursor = None
+        for page in range(1, 4):
+            endpoint = "/api/properties?tr=Vente&sort=-pr&limit=3"
+            if cursor:
+                endpoint += f"&cursor={cursor}"
+            url = f"{self.base_url}{endpoint}"
+            self.tests_run += 1
+            print(f"\n🔍 Testing Properties Page {page}...")
+            try:
+                response = requests.get(url, timeout=10)
+            except requests.exceptions.RequestException as e:
+                self.log_issue(endpoint, f"Request error: {str(e)}", "HIGH")
+                return False
+            if response.status_code != 200:
+                print(f"❌ Failed - Expected 200, got {response.status_code}")
+                self.log_issue(endpoint, f"Expected 200, got {response.status_code}", "HIGH")
+                return False
+            self.tests_passed += 1
+            items = response.json()
+            if any(p['tr'] != 'Vente' for p in items):
+                self.log_issue(endpoint, "Filter tr=Vente returned other transactions", "HIGH")
+            seen.extend(items)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        prices = [p['pr'] for p in seen]
+        if prices != sorted(prices, reverse=True):
+            self.log_issue("/api/properties", "Pages are not sorted by descending price", "HIGH")
+            return False
+        if len({p['id'] for p in seen}) != len(seen):
+            self.log_issue("/api/properties", "Cursor pagination returned duplicates", "HIGH")
+            return False
+        print(f"✅ {len(seen)} properties paginated in price order")
+        return True
+
+    def test_conditional_get(self):
+        """Test ETag / If-None-Match revalidation of the catalogue"""
+        endpoint = "/api/properties"
+        url = f"{self.base_url}{endpoint}"
+        self.tests_run += 1
+        print(f"\n🔍 Testing Conditional GET...")
+        try:
+            first = requests.get(url, timeout=10)
+            etag = first.headers.get("ETag")
+            if not etag:
+                print("❌ No ETag header on catalogue response")
+                self.log_issue(endpoint, "Missing ETag header", "MEDIUM")
+                return False
+            second = requests.get(url, headers={"If-None-Match": etag}, timeout=10)
+        except requests.exceptions.RequestException as e:
+            self.log_issue(endpoint, f"Request error: {str(e)}", "HIGH")
+            return False
+
+        if second.status_code == 304 and not second.content:
+            self.tests_passed += 1
+            print(f"✅ Passed - 304 Not Modified for ETag {etag}")
+            return True
+        print(f"❌ Failed - Expected 304, got {second.status_code}")
+        self.log_issue(endpoint, f"If-None-Match returned {second.status_code} instead of 304", "MEDIUM")
+        return False
+
+    def test_lot_reservations(self):
+        """Test reserve/release: status flips, 409 guards and Idempotency-Key replay"""
+        success, lot = self.run_test(
+            "Create Lot for Reservations",
+            "POST",
+            "/api/lots",
+            200,
+            data={"loc": "Test Location", "zone": "Test", "lots": 2, "dispo": 1, "su": 100, "pr": 1000000}
+        )
+        if not success or 'id' not in lot:
+            return False
+        lot_id = lot['id']
+        endpoint = f"/api/lots/{lot_id}"
+        key_headers = lambda key: {'Content-Type': 'application/json', 'Idempotency-Key': key}
+        reserve_key = f"test-reserve-{datetime.now().timestamp()}"
+        release_key = f"test-release-{datetime.now().timestamp()}"
+        ok = True
+
+        success, response = self.run_test(
+            "Reserve Last Plot", "POST", f"{endpoint}/reserve", 200,
+            data={"n": 1}, headers=key_headers(reserve_key)
+        )
+        if success and (response['lot']['dispo'] != 0 or response['lot']['st'] != "Épuisé" or response['replayed']):
+            print(f"❌ Expected dispo 0, status Épuisé, not replayed: {response}")
+            self.log_issue(f"{endpoint}/reserve", "Reservation did not sell the lot out", "HIGH")
+            ok = False
+        ok = success and ok
+
+        success, response = self.run_test(
+            "Replay Reservation Key", "POST", f"{endpoint}/reserve", 200,
+            data={"n": 1}, headers=key_headers(reserve_key)
+        )
+        if success and (not response['replayed'] or response['lot']['dispo'] != 0):
+            print(f"❌ Retried reservation was applied again: {response}")
+            self.log_issue(f"{endpoint}/reserve", "Idempotency-Key retry reserved twice", "HIGH")
+            ok = False
+        ok = success and ok
+
+        ok = self.run_test("Reserve Sold-Out Lot", "POST", f"{endpoint}/reserve", 409, data={"n": 1})[0] and ok
+        ok = self.run_test("Release Above Total", "POST", f"{endpoint}/release", 409, data={"n": 3})[0] and ok
+
+        success, response = self.run_test(
+            "Release Plot", "POST", f"{endpoint}/release", 200,
+            data={"n": 1}, headers=key_headers(release_key)
+        )
+        if success and (response['lot']['dispo'] != 1 or response['lot']['st'] != "Limité"):
+            print(f"❌ Expected dispo 1, status Limité: {response}")
+            self.log_issue(f"{endpoint}/release", "Release did not reopen the lot", "HIGH")
+            ok = False
+        ok = success and ok
+
+        success, response = self.run_test(
+            "Replay Release Key", "POST", f"{endpoint}/release", 200,
+            data={"n": 1}, headers=key_headers(release_key)
+        )
+        if success and (not response['replayed'] or response['lot']['dispo'] != 1):
+            print(f"❌ Retried release was applied again: {response}")
+            self.log_issue(f"{endpoint}/release", "Idempotency-Key retry released twice", "HIGH")
+            ok = False
+        ok = success and ok
+
+        ok = self.run_test("Reserve Unknown Lot", "POST", "/api/lots/no-such-lot/reserve", 404, data={"n": 1})[0] and ok
+        self.run_test("Delete Reservation Lot", "DELETE", endpoint, 200)
+        return ok
+
+    def test_sync_summary(self):
+        """Test incremental sync: only the changed and new lots are written, a retry writes nothing"""
+        success, manifest = self.run_test("Get Lots Manifest", "GET", "/api/sync/lots", 200)
+        if not success or not manifest:
+            return False
+        target = sorted(manifest)[0]
+        success, original = self.run_test(f"Get Lot {target}", "GET", f"/api/lots/{target}", 200)
+        if not success:
+            return False
+        unchanged = [{"id": i, "h": h} for i, h in manifest.items() if i != target]
+        new_lot = {"loc": "Test Location", "zone": "Sync", "lots": 10, "dispo": 10, "su": 150, "pr": 2000000}
+        new_id = f"test-sync-{int(datetime.now().timestamp())}"
+        items = unchanged + [{"id": target, "data": dict(original, zone="Sync Test")}, {"id": new_id, "data": new_lot}]
+
+        success, summary = self.run_test("Sync Lots", "POST", "/api/sync/lots", 200, data=items)
+        if not success:
+            return False
+        ok = (
+            summary['updated'] == [target] and summary['inserted'] == [new_id] and not summary['deleted']
+            and summary['unchanged'] == len(unchanged) and not summary['missing'] and not summary['stale']
+        )
+        if ok:
+            print(f"✅ Sync wrote 1 update and 1 insert, left {summary['unchanged']} lots untouched")
+        else:
+            print(f"❌ Unexpected sync summary: {summary}")
+            self.log_issue("/api/sync/lots", f"Unexpected sync summary: {summary}", "HIGH")
+
+        success, summary = self.run_test("Retry Lots Sync", "POST", "/api/sync/lots", 200, data=items)
+        if success and (summary['inserted'] or summary['updated'] or summary['deleted']):
+            print(f"❌ Retried sync wrote again: {summary}")
+            self.log_issue("/api/sync/lots", f"Retried sync was not a no-op: {summary}", "HIGH")
+            ok = False
+        ok = success and ok
+
+        # Put the catalogue back: restores the edited lot, deletes the inserted one
+        success, summary = self.run_test(
+            "Restore Lots by Sync",
+            "POST",
+            "/api/sync/lots",
+            200,
+            data=unchanged + [{"id": target, "data": original}]
+        )
+        if success and summary['updated'] != [target]:
+            self.log_issue("/api/sync/lots", f"Restore did not update {target}: {summary}", "MEDIUM")
+        return ok and success
+
+    def test_import_line_errors(self):
+        """Test NDJSON import: invalid lines are reported by number and skipped"""
+        endpoint = "/api/import?collection=lots"
+        url = f"{self.base_url}{endpoint}"
+        lot_id = f"test-import-{int(datetime.now().timestamp())}"
+        body = "\n".join([
+            json.dumps({"id": lot_id, "loc": "Test Location", "lots": 5, "dispo": 5}),
+            "{not json",
+            json.dumps({"collection": "lots", "doc": {"lots": 5}}),
+        ]) + "\n"
+        self.tests_run += 1
+        print(f"\n🔍 Testing Import Line Errors...")
+        try:
+            response = requests.post(
+                url, data=body.encode(), headers={"Content-Type": "application/x-ndjson"}, timeout=10
+            )
+        except requests.exceptions.RequestException as e:
+            self.log_issue(endpoint, f"Request error: {str(e)}", "HIGH")
+            return False
+        if response.status_code != 200:
+            print(f"❌ Failed - Expected 200, got {response.status_code}")
+            self.log_issue(endpoint, f"Expected 200, got {response.status_code}", "HIGH")
+            return False
+
+        report = response.json()
+        requests.delete(f"{self.base_url}/api/lots/{lot_id}", timeout=10)
+        error_lines = [e['line'] for e in report['errors']]
+        if report['lines'] == 3 and report['imported'] == {"lots": 1} and error_lines == [2, 3]:
+            self.tests_passed += 1
+            print(f"✅ Passed - 1 lot imported, errors on lines {error_lines}")
+            return True
+        print(f"❌ Unexpected import report: {report}")
+        self.log_issue(endpoint, f"Unexpected import report: {report}", "HIGH")
+        return False
+
+    def test_idempotent_replay(self):
+        """Test Idempotency-Key on a create: one write, replayed response, 422 for another body"""
+        endpoint = "/api/lots"
+        url = f"{self.base_url}{endpoint}"
+        headers = {"Content-Type": "application/json", "Idempotency-Key": f"test-create-{datetime.now().timestamp()}"}
+        lot = {"loc": "Test Location", "zone": "Idempotency", "lots": 3, "dispo": 3}
+        self.tests_run += 1
+        print(f"\n🔍 Testing Idempotent Replay...")
+        try:
+            first = requests.post(url, json=lot, headers=headers, timeout=10)
+            retry = requests.post(url, json=lot, headers=headers, timeout=10)
+            other = requests.post(url, json=dict(lot, lots=4), headers=headers, timeout=10)
+        except requests.exceptions.RequestException as e:
+            self.log_issue(endpoint, f"Request error: {str(e)}", "HIGH")
+            return False
+        if first.status_code == 200:
+            requests.delete(f"{url}/{first.json()['id']}", timeout=10)
+
+        if first.status_code != 200 or retry.status_code != 200:
+            print(f"❌ Failed - Expected 200 twice, got {first.status_code} and {retry.status_code}")
+            self.log_issue(endpoint, f"Create with Idempotency-Key returned {first.status_code}/{retry.status_code}", "HIGH")
+            return False
+        if retry.json()['id'] != first.json()['id'] or retry.headers.get("Idempotent-Replayed") != "true":
+            print(f"❌ Retry was not a replay: {first.json()['id']} then {retry.json()['id']}")
+            self.log_issue(endpoint, "Retry with the same Idempotency-Key created a second lot", "HIGH")
+            return False
+        if other.status_code != 422:
+            print(f"❌ Failed - Expected 422 for a reused key, got {other.status_code}")
+            self.log_issue(endpoint, f"Reused Idempotency-Key with another body returned {other.status_code}", "HIGH")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - retry replayed {first.json()['id']}, other body rejected with 422")
+        return True
+
     def run_all_tests(self):
         """Run all backend API tests"""
         print(f"🚀 Starting Backend API Testing for DIALIBATOU BTP IMMOBILIER")
@@ -270,6 +515,24 @@ class BackendAPITester:
         if properties:
             self.test_get_single_property(properties)
 
+        # Test 4b: Filtered cursor pagination
+        self.test_paginated_properties()
+
+        # Test 4c: ETag revalidation
+        self.test_conditional_get()
+
+        # Test 4d: Lot reservations and releases
+        self.test_lot_reservations()
+
+        # Test 4e: Incremental sync summary
+        self.test_sync_summary()
+
+        # Test 4f: Import with invalid lines
+        self.test_import_line_errors()
+
+        # Test 4g: Idempotency-Key replay
+        self.test_idempotent_replay()
+
         # Test 5: Create Property
         create_success, created_id = self.test_create_property()
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark for the DIALIBATOU BTP API.
+
+Drives N parallel clients against a running server and reports throughput
+and latency percentiles. Run it once against the old build and once
+against the new one to compare:
+
+    python benchmarks/bench_concurrency.py --url http://localhost:8001 --label before
+    python benchmarks/bench_concurrency.py --url http://localhost:8001 --label after
+
+Point both builds at a real `mongod`. Against mongomock every query is
+evaluated in the server process, so there is no I/O for the async driver
+to overlap and the two builds measure about the same.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+
+DEFAULT_ENDPOINTS = ["/api/properties", "/api/lots", "/api/properties/p1", "/api/lots/lot1"]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return 0.0
+    k = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples))) - 1))
+    return samples[k]
+
+
+async def client_loop(http, endpoints, deadline, latencies, errors):
+    i = 0
+    while time.perf_counter() < deadline:
+        path = endpoints[i % len(endpoints)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = await http.get(path)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(url, clients, duration, endpoints):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as http:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[
+            client_loop(http, endpoints, deadline, latencies, errors) for _ in range(clients)
+        ])
+    latencies.sort()
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def main_async(args):
+    results = []
+    for clients in args.clients:
+        result = await run_level(args.url, clients, args.duration, args.endpoints)
+        print(f"   {clients:>4} clients: {result['throughput_rps']:>8} req/s  "
+              f"p50 {result['p50_ms']}ms  p99 {result['p99_ms']}ms  errors {result['errors']}",
+              file=sys.stderr)
+        results.append(result)
+    return {"label": args.label, "url": args.url, "duration_s": args.duration, "levels": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS)
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Detail lookup benchmark: find by id as the collection grows.
+
+Fills a properties collection with listings carrying ids from
+ids.new_id, in steps up to each size, and after each step measures
+`find_one` latency for random stored ids, the documents Mongo examined
+for one lookup (from explain) and the insert throughput of the step.
+With the unique `id` index a lookup examines one document and its latency
+should stay flat from 1k to 1M documents; --no-index shows the
+collection scan it replaces:
+
+    python benchmarks/bench_lookup.py --mongod --sizes 1000,10000,100000,1000000
+    python benchmarks/bench_lookup.py --mongo-url mongodb://localhost:27017 --no-index
+
+Needs a real Mongo: mongomock has no indexes, every lookup is a scan.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from bench_concurrency import percentile  # noqa: E402
+from bench_suite import _scratch, property_docs, start_mongod  # noqa: E402
+from database import PROPERTY_INDEXES, Database, Repository  # noqa: E402
+from ids import new_id  # noqa: E402
+
+BATCH = 10000
+
+
+async def fill(repo, count, ids):
+    """Insert `count` more listings, appending their ids to `ids`"""
+    while count > 0:
+        docs = property_docs(min(BATCH, count), seed=len(ids))
+        for doc in docs:
+            doc["id"] = new_id("p")
+            ids.append(doc["id"])
+        await repo.col.insert_many(docs, ordered=False)
+        count -= len(docs)
+
+
+async def main_async(args, mongo_url):
+    database = Database(mongo_url, f"bench_lookup_{os.getpid()}")
+    indexes = [] if args.no_index else PROPERTY_INDEXES
+    repo = Repository(database, "properties", indexes)
+    await repo.ensure_indexes()
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    for _ in range(args.queries):
+        new_id("p")
+    mint_us = (time.perf_counter() - start) / args.queries * 1e6
+
+    ids, results = [], []
+    try:
+        for size in args.sizes:
+            added = size - len(ids)
+            start = time.perf_counter()
+            await fill(repo, added, ids)
+            insert_s = time.perf_counter() - start
+
+            for doc_id in rng.choices(ids, k=min(100, args.queries)):  # warm the cache
+                await repo.find_one(doc_id)
+            latencies = []
+            for doc_id in rng.choices(ids, k=args.queries):
+                start = time.perf_counter()
+                await repo.find_one(doc_id)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            plan = await repo.col.find({"id": ids[-1]}).explain()
+
+            row = {
+                "size": size,
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "docs_examined": plan["executionStats"]["totalDocsExamined"],
+                "insert_docs_per_s": round(added / insert_s) if added else None,
+            }
+            print(f"   {size:>8} docs: p50 {row['p50_ms']}ms  p99 {row['p99_ms']}ms  "
+                  f"examined {row['docs_examined']}  inserts {row['insert_docs_per_s']}/s", file=sys.stderr)
+            results.append(row)
+    finally:
+        await database.client.drop_database(database.name)
+        await database.close()
+    return {"index": not args.no_index, "queries": args.queries, "mint_us": round(mint_us, 2), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--no-index", action="store_true", help="measure without the indexes, for comparison")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--mongod", nargs="?", const=shutil.which("mongod") or "mongod",
+                       help="run against a temporary mongod (optionally the binary's path)")
+    group.add_argument("--mongo-url")
+    args = parser.parse_args()
+
+    mongod = None
+    try:
+        if args.mongod:
+            mongod, mongo_url = start_mongod(args.mongod)
+        else:
+            mongo_url = args.mongo_url
+        report = asyncio.run(main_async(args, mongo_url))
+    finally:
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+        shutil.rmtree(_scratch, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test for lot reservations.
+
+Fires many parallel POST /api/lots/{id}/reserve calls at one lot, then
+checks that no plot was oversold: the successful reservations must add up
+exactly to the drop in `dispo`, which must never go below zero. Some
+requests are retried with the same Idempotency-Key to check they are not
+applied twice. With --restore the reserved plots are released afterwards.
+
+    python benchmarks/bench_reservations.py --url http://localhost:8001 --lot lot3 --requests 500
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+
+import httpx
+
+
+async def reserve(http, lot_id, key, semaphore, outcomes):
+    async with semaphore:
+        start = time.perf_counter()
+        response = await http.post(f"/api/lots/{lot_id}/reserve", json={"n": 1},
+                                   headers={"Idempotency-Key": key})
+        elapsed = time.perf_counter() - start
+    body = response.json() if response.status_code == 200 else {}
+    outcomes.append((response.status_code, body.get("replayed", False), elapsed))
+
+
+async def main_async(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as http:
+        before = (await http.get(f"/api/lots/{args.lot}")).json()
+        keys = [uuid.uuid4().hex for _ in range(args.requests)]
+        # Every tenth request is sent twice, as a client retry would
+        attempts = keys + keys[::10]
+        semaphore = asyncio.Semaphore(args.concurrency)
+        outcomes = []
+        start = time.perf_counter()
+        await asyncio.gather(*[reserve(http, args.lot, key, semaphore, outcomes) for key in attempts])
+        elapsed = time.perf_counter() - start
+        after = (await http.get(f"/api/lots/{args.lot}")).json()
+
+        applied = sum(1 for status, replayed, _ in outcomes if status == 200 and not replayed)
+        replayed = sum(1 for status, replayed, _ in outcomes if status == 200 and replayed)
+        rejected = sum(1 for status, _, _ in outcomes if status == 409)
+        errors = sum(1 for status, _, _ in outcomes if status not in (200, 409))
+        oversold = after["dispo"] < 0 or before["dispo"] - after["dispo"] != applied
+
+        if args.restore and applied:
+            await http.post(f"/api/lots/{args.lot}/release", json={"n": applied})
+
+    latencies = sorted(t for _, _, t in outcomes)
+    return {
+        "lot": args.lot,
+        "requests": len(attempts),
+        "concurrency": args.concurrency,
+        "dispo_before": before["dispo"],
+        "dispo_after": after["dispo"],
+        "applied": applied,
+        "replayed": replayed,
+        "rejected_409": rejected,
+        "errors": errors,
+        "oversold": oversold,
+        "throughput_rps": round(len(attempts) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--lot", default="lot3")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--restore", action="store_true", help="release the reserved plots afterwards")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    print(json.dumps(report, indent=2))
+    return 1 if report["oversold"] or report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
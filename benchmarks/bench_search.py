@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Search index benchmark on a synthetic catalogue.
+
+Builds the in-process index over N generated listings (100k by default)
+and times a mix of full-word, multi-word, accented and type-ahead queries:
+
+    python benchmarks/bench_search.py --size 100000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from search_index import SearchIndex  # noqa: E402
+
+TYPES = ["Appartement", "Villa", "Terrain", "Bureau", "Studio", "Duplex", "Immeuble"]
+TRANSACTIONS = ["Vente", "Location"]
+QUARTIERS = [
+    "Almadies", "Mermoz", "Plateau", "Ouakam", "Ngor", "Point E", "Fann", "Sacré-Cœur",
+    "Liberté", "Mamelles", "Yoff", "Keur Massar", "Bambilor", "Sébikotane", "Thiès",
+    "Diass", "Saly", "Mbour", "Toubab Dialao", "Yène",
+]
+FEATURES = [
+    "Piscine", "Parking", "Sécurité 24h", "Vue mer", "Climatisation", "Balcon", "Jardin",
+    "Terrasse", "Meublé", "Titre foncier", "Ascenseur", "Groupe électrogène",
+]
+ADJECTIVES = [
+    "Luxueux", "Moderne", "Charmant", "Spacieux", "Lumineux", "Rénové", "Neuf",
+    "Contemporain", "Exceptionnel", "Calme", "Sécurisé", "Élégant",
+]
+DESCRIPTION_WORDS = (
+    "superbe appartement standing vue imprenable océan résidence sécurisée finitions "
+    "haut gamme chambres terrasse salon double balcon cuisine équipée climatisées "
+    "emplacement premium proche plage commerces écoles jardin paysager piscine chauffée "
+    "bureau garage voitures construction récente panneaux solaires quartier calme "
+    "accès bitumé titre foncier viabilisé eau électricité assainissement idéal famille "
+    "investissement locatif rendement lumineux parquet vérandas hauts plafonds"
+).split()
+
+QUERIES = [
+    "villa",
+    "piscine",
+    "villa almadies",
+    "appartement vue mer",
+    "sacre coeur",
+    "Sacré-Cœur villa",
+    "terrain titre foncier saly",
+    "meublée climatisation",
+    "pisc",
+    "app",
+    "villa moder",
+]
+
+
+def synthetic_catalogue(size, seed=42):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(size):
+        ty = rng.choice(TYPES)
+        nb = rng.choice(QUARTIERS)
+        docs.append({
+            "id": f"p{i}",
+            "ti": f"{ty} {rng.choice(ADJECTIVES)} {nb}",
+            "de": " ".join(rng.choices(DESCRIPTION_WORDS, k=rng.randint(12, 40))),
+            "ty": ty,
+            "tr": rng.choice(TRANSACTIONS),
+            "pr": rng.randint(20, 900) * 1_000_000,
+            "nb": nb,
+            "fe": rng.sample(FEATURES, rng.randint(0, 5)),
+        })
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    docs = synthetic_catalogue(args.size)
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.rebuild(docs)
+    build_s = time.perf_counter() - start
+
+    # Warm the impact-sorted lists, as a running server would be
+    for q in QUERIES:
+        index.search(q, args.limit)
+
+    results = []
+    for q in QUERIES:
+        timings = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            hits = index.search(q, args.limit)
+            timings.append(time.perf_counter() - t0)
+        timings.sort()
+        results.append({
+            "q": q,
+            "hits": len(hits),
+            "p50_ms": round(timings[len(timings) // 2] * 1000, 4),
+            "p99_ms": round(timings[int(len(timings) * 0.99) - 1] * 1000, 4),
+        })
+
+    start = time.perf_counter()
+    for doc in docs[:1000]:
+        index.add(dict(doc, ti=doc["ti"] + " rénovée"))
+    update_ms = (time.perf_counter() - start) * 1000 / 1000
+
+    report = {
+        "size": args.size,
+        "build_s": round(build_s, 2),
+        "incremental_update_ms": round(update_ms, 4),
+        "queries": results,
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
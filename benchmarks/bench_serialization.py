@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Serialization micro-benchmark for property listings.
+
+Compares FastAPI's response_model path (validate every item into
+PropertyResponse, convert to JSON-compatible data, encode with json)
+with encoding the stored documents directly, using the json module and
+orjson, and measures gzip/brotli on the result:
+
+    python benchmarks/bench_serialization.py --sizes 100,1000,10000
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import encoding  # noqa: E402
+from bench_suite import property_docs  # noqa: E402
+from server import PropertyResponse  # noqa: E402
+
+
+def timed(fn, repeat):
+    """Best of `repeat` runs, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best * 1000, 3), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    field = create_response_field("response", List[PropertyResponse], mode="serialization")
+    loop = asyncio.new_event_loop()
+
+    def response_model_path(docs):
+        content = loop.run_until_complete(serialize_response(field=field, response_content=docs))
+        return JSONResponse(content).body
+
+    def stdlib_json(docs):
+        return json.dumps(docs, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    results = []
+    for size in args.sizes:
+        docs = property_docs(size)
+        row = {"size": size}
+        row["response_model_ms"], _ = timed(lambda: response_model_path(docs), args.repeat)
+        row["json_ms"], body = timed(lambda: stdlib_json(docs), args.repeat)
+        if encoding.orjson is not None:
+            row["orjson_ms"], body = timed(lambda: encoding.dump_json(docs), args.repeat)
+        row["bytes"] = len(body)
+        row["gzip_ms"], packed = timed(lambda: gzip.compress(body, encoding.GZIP_LEVEL), args.repeat)
+        row["gzip_bytes"] = len(packed)
+        if encoding.brotli is not None:
+            row["br_ms"], packed = timed(lambda: encoding.compress(body, "br"), args.repeat)
+            row["br_bytes"] = len(packed)
+        print(f"   {size:>6} docs: response_model {row['response_model_ms']}ms  json {row['json_ms']}ms  "
+              f"orjson {row.get('orjson_ms', '-')}ms  gzip {row['gzip_ms']}ms", file=sys.stderr)
+        results.append(row)
+
+    print(json.dumps({"orjson": encoding.orjson is not None, "brotli": encoding.brotli is not None,
+                      "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Similar-listings benchmark.
+
+Builds the similarity index over a synthetic catalogue, then measures
+lookup latency for random listings and the cost of an incremental
+update (one add plus one remove):
+
+    python benchmarks/bench_similar.py --sizes 1000,10000,100000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from bench_concurrency import percentile  # noqa: E402
+from bench_suite import property_docs  # noqa: E402
+from similarity import SimilarityIndex  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=6)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        docs = property_docs(size)
+        rng = random.Random(size)
+        index = SimilarityIndex()
+
+        start = time.perf_counter()
+        index.rebuild(docs)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        latencies = []
+        for doc in rng.choices(docs, k=args.queries):
+            start = time.perf_counter()
+            index.similar(doc["id"], args.limit)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        updates = []
+        for i, doc in enumerate(rng.choices(docs, k=args.queries)):
+            start = time.perf_counter()
+            index.add(dict(doc, id=f"bench{i}"))
+            index.remove(doc["id"])
+            updates.append((time.perf_counter() - start) * 1000)
+
+        row = {
+            "size": size,
+            "build_ms": round(build_ms, 1),
+            "query_p50_ms": round(percentile(sorted(latencies), 50), 3),
+            "query_p99_ms": round(percentile(sorted(latencies), 99), 3),
+            "update_p50_ms": round(percentile(sorted(updates), 50), 4),
+            "matrix_mb": round(index.vectors.nbytes / 1e6, 1),
+        }
+        print(f"   {size:>7} docs: build {row['build_ms']}ms  query p50 {row['query_p50_ms']}ms  "
+              f"p99 {row['query_p99_ms']}ms  update {row['update_p50_ms']}ms", file=sys.stderr)
+        results.append(row)
+
+    print(json.dumps({"dims": SimilarityIndex().dims, "limit": args.limit, "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
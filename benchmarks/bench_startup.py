@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark: eager vs lazy initialization.
+
+Starts backend/server.py as a fresh process, repeatedly, with and without
+LAZY_INIT=1, and measures the time from spawning the process to the first
+response of a health check, a card listing and a search, plus the
+process's resident memory after each:
+
+    python benchmarks/bench_startup.py --mongod --runs 5
+    python benchmarks/bench_startup.py --runs 5          # mongomock
+
+With mongod one untimed start seeds the database first, so the timed
+runs are warm starts of an already prepared database. With mongomock
+every process starts with an empty in-memory database and seeds it,
+which is closer to a first deployment.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench_suite import _scratch, free_port, start_mongod
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+PROBES = [
+    ("health", "/api/health"),
+    ("listing", "/api/properties?view=card&limit=20"),
+    ("search", "/api/search?q=villa"),
+]
+
+# Serves the app on a mongomock database, for machines without mongod
+MONGOMOCK_LAUNCHER = """
+import os, sys
+sys.path.insert(0, {backend!r})
+import mongomock_motor, uvicorn
+import database
+database.database.client = mongomock_motor.AsyncMongoMockClient()
+uvicorn.run("server:app", host="127.0.0.1", port=int(os.environ["PORT"]), log_level="warning")
+"""
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            response = httpx.get(url, timeout=30)
+            if response.status_code < 500:
+                return response.status_code
+        except httpx.HTTPError:
+            time.sleep(0.005)
+    raise RuntimeError(f"no response from {url}")
+
+
+def cold_start(lazy, mongo_url):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), MEDIA_ROOT=os.path.join(_scratch, "media"), LAZY_INIT="1" if lazy else "")
+    if mongo_url:
+        env.update(MONGO_URL=mongo_url, DB_NAME="bench_startup")
+        command = [sys.executable, os.path.join(BACKEND, "server.py")]
+    else:
+        command = [sys.executable, "-c", MONGOMOCK_LAUNCHER.format(backend=BACKEND)]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    row = {}
+    try:
+        deadline = start + 120
+        for name, path in PROBES:
+            wait_for(f"http://127.0.0.1:{port}{path}", deadline)
+            row[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            row[f"{name}_rss_mb"] = rss_mb(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+    return row
+
+
+def summarize(rows):
+    return {key: statistics.median(r[key] for r in rows if r[key] is not None) for key in rows[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--mongod", nargs="?", const=shutil.which("mongod") or "mongod",
+                       help="run against a temporary mongod (optionally the binary's path)")
+    group.add_argument("--mongo-url")
+    args = parser.parse_args()
+
+    mongod = None
+    try:
+        mongo_url = args.mongo_url
+        if args.mongod:
+            mongod, mongo_url = start_mongod(args.mongod)
+        if mongo_url:
+            cold_start(False, mongo_url)  # seeds the database
+        report = {"backend": "mongod" if mongo_url else "mongomock", "runs": args.runs, "modes": {}}
+        for lazy in (False, True):
+            mode = "lazy" if lazy else "eager"
+            rows = [cold_start(lazy, mongo_url) for _ in range(args.runs)]
+            report["modes"][mode] = summarize(rows)
+            m = report["modes"][mode]
+            print(f"   {mode:<5}: health {m['health_ms']}ms ({m['health_rss_mb']}MB)  "
+                  f"listing {m['listing_ms']}ms ({m['listing_rss_mb']}MB)  "
+                  f"search {m['search_ms']}ms ({m['search_rss_mb']}MB)", file=sys.stderr)
+    finally:
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+        shutil.rmtree(_scratch, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Load and latency benchmark suite for the DIALIBATOU BTP API.
+
+backend_test.py checks that a live server answers correctly; this suite
+measures how fast it does so. The FastAPI app is run in-process against
+mongomock (default) or a throwaway `mongod`, seeded with synthetic
+catalogues of each size, and concurrent async clients drive the list,
+detail, search, upload, sync and bulk workloads. Throughput and p50/p95/p99
+latency are printed as JSON:
+
+    pip install -r backend/requirements-dev.txt
+    python benchmarks/bench_suite.py --sizes 1000,10000 --output run.json
+    python benchmarks/bench_suite.py --mongod --sizes 1000,10000,100000
+
+With --baseline the run is compared to a stored report and the exit code
+is 1 if any workload's p95 grew, or its throughput dropped, by more than
+--tolerance. --save-baseline writes the run as the new baseline. Only
+compare runs made on the same machine with the same backend: mongomock
+evaluates queries in Python, so its numbers say little about Mongo itself.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from bench_concurrency import percentile  # noqa: E402
+from bench_search import QUARTIERS, QUERIES, synthetic_catalogue  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Requests per workload and how many of them run at once
+WORKLOADS = {
+    "list": (2000, None),
+    "detail": (2000, None),
+    "search": (2000, None),
+    "upload": (200, None),
+    "sync": (10, 1),
+    # Replaces the catalogue under new ids, so it runs last
+    "bulk": (10, 1),
+}
+SORTS = [None, "pr", "-pr", "su", "-vi"]
+LOT_LOCATIONS = ["Bambilor", "Thiès", "Diass", "Sébikotane", "Keur Massar", "Mbour", "Saly", "Yène"]
+
+# MEDIA_ROOT is read on import, so the media store must be pointed at a
+# scratch directory before the app is loaded
+_scratch = tempfile.mkdtemp(prefix="dialibatou-bench-")
+os.environ["MEDIA_ROOT"] = os.path.join(_scratch, "media")
+
+
+def property_docs(size, seed=42):
+    rng = random.Random(seed)
+    docs = synthetic_catalogue(size, seed)
+    for doc in docs:
+        doc.update({
+            "su": rng.randint(30, 1200),
+            "ro": rng.randint(0, 12),
+            "be": rng.randint(0, 6),
+            "ba": rng.randint(0, 5),
+            "im": [f"https://images.unsplash.com/photo-{rng.randint(10**12, 10**13)}?w=800"],
+            "vd": [],
+            "ft": rng.random() < 0.2,
+            "vi": rng.randint(0, 1000),
+            "ag": {"na": "Mame Cheikh Ndiaye", "ph": "+221 77 709 61 44"},
+        })
+    return docs
+
+
+def lot_docs(size, seed=42):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(size):
+        lots = rng.randint(10, 200)
+        dispo = rng.randint(0, lots)
+        docs.append({
+            "id": f"lot{i}",
+            "loc": rng.choice(LOT_LOCATIONS),
+            "zone": f"Zone {chr(65 + i % 6)}",
+            "lots": lots,
+            "dispo": dispo,
+            "su": rng.choice([150, 200, 250, 300, 500]),
+            "pr": rng.randint(2, 20) * 1_000_000,
+            "st": "Disponible",
+            "fe": ["Titre foncier", "Eau", "Électricité"],
+        })
+    return docs
+
+
+def upload_payloads(count, seed=42):
+    """Distinct images, so every upload is stored and thumbnailed.
+
+    Use a different seed per run over the same media store: an image
+    already stored is deduplicated and costs almost nothing.
+    """
+    # Real images: the server sniffs uploads with Pillow and refuses anything else
+    from PIL import Image
+    rng = random.Random(seed)
+    payloads = []
+    for _ in range(count):
+        image = Image.new("RGB", (1024, 768), tuple(rng.randrange(256) for _ in range(3)))
+        image.putpixel((rng.randrange(1024), rng.randrange(768)), (255, 255, 255))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        payloads.append(buffer.getvalue())
+    return payloads
+
+
+class Workloads:
+    """Request generators, one per workload, over a seeded catalogue"""
+
+    def __init__(self, properties, lots, uploads, seed=7):
+        self.rng = random.Random(seed)
+        self.property_ids = [d["id"] for d in properties]
+        self.properties = properties
+        self.lots = lots
+        self.uploads = uploads
+        self.sync_round = 0
+
+    async def list(self, http):
+        params = {"limit": 20}
+        if self.rng.random() < 0.7:
+            params["nb"] = self.rng.choice(QUARTIERS)
+        if self.rng.random() < 0.5:
+            params["tr"] = self.rng.choice(["Vente", "Location"])
+        sort = self.rng.choice(SORTS)
+        if sort:
+            params["sort"] = sort
+        return await http.get("/api/properties", params=params)
+
+    async def detail(self, http):
+        return await http.get(f"/api/properties/{self.rng.choice(self.property_ids)}")
+
+    async def search(self, http):
+        return await http.get("/api/search", params={"q": self.rng.choice(QUERIES)})
+
+    async def upload(self, http):
+        data = self.uploads.pop()
+        return await http.post("/api/upload", files={"file": ("photo.jpg", data, "image/jpeg")})
+
+    async def sync(self, http):
+        # The admin saving its list: everything sent by id, 50 entries edited
+        self.sync_round += 1
+        docs, path = (self.properties, "/api/sync/properties") if self.sync_round % 2 else (self.lots, "/api/sync/lots")
+        edited = {i: None for i in self.rng.sample(range(len(docs)), min(50, len(docs)))}
+        items = []
+        for i, doc in enumerate(docs):
+            if i in edited:
+                data = {k: v for k, v in doc.items() if k != "id"}
+                data["pr"] = doc["pr"] + self.sync_round
+                items.append({"id": doc["id"], "data": data})
+            else:
+                items.append({"id": doc["id"]})
+        return await http.post(path, json=items)
+
+    async def bulk(self, http):
+        # The whole catalogue replaced through the /bulk routes, which mint new ids
+        self.sync_round += 1
+        docs, path = (self.properties, "/api/properties/bulk") if self.sync_round % 2 else (self.lots, "/api/lots/bulk")
+        return await http.post(path, json=[{k: v for k, v in doc.items() if k != "id"} for doc in docs])
+
+
+async def run_workload(http, request, count, concurrency):
+    latencies, errors = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await request(http)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+            except httpx.HTTPError as e:
+                errors.append(type(e).__name__)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(count)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": count,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "throughput_rps": round(count / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mongod(binary):
+    """Start a throwaway mongod; returns (process, url)"""
+    port = free_port()
+    dbpath = os.path.join(_scratch, "db")
+    os.makedirs(dbpath, exist_ok=True)
+    process = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, f"mongodb://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("mongod did not start")
+
+
+def request_count(name, scale):
+    return max(1, int(WORKLOADS[name][0] * scale))
+
+
+async def run_size(server, size, args):
+    properties = property_docs(size)
+    lots = lot_docs(size)
+    start = time.perf_counter()
+    await server.properties_repo.replace_all(properties)
+    await server.lots_repo.replace_all(lots)
+    seed_s = time.perf_counter() - start
+
+    uploads = upload_payloads(request_count("upload", args.scale), seed=size) if "upload" in args.workloads else []
+    workloads = Workloads(properties, lots, uploads)
+    results = {"seed_s": round(seed_s, 2)}
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=300) as http:
+        for name in args.workloads:
+            concurrency = WORKLOADS[name][1] or args.clients
+            result = await run_workload(
+                http, getattr(workloads, name), request_count(name, args.scale), concurrency
+            )
+            print(f"   {size:>7} {name:<7} {result['throughput_rps']:>9} req/s  p50 {result['p50_ms']}ms  "
+                  f"p95 {result['p95_ms']}ms  p99 {result['p99_ms']}ms  errors {result['errors']}",
+                  file=sys.stderr)
+            results[name] = result
+    return results
+
+
+async def main_async(args):
+    import database
+    if args.mongod:
+        process, url = start_mongod(args.mongod)
+        database.database.url = url
+    else:
+        import mongomock_motor
+        process = None
+        database.database.client = mongomock_motor.AsyncMongoMockClient()
+
+    import server
+    for handler in server.app.router.on_startup:
+        await handler()
+    try:
+        results = {}
+        for size in args.sizes:
+            results[str(size)] = await run_size(server, size, args)
+    finally:
+        for handler in server.app.router.on_shutdown:
+            await handler()
+        if process is not None:
+            process.terminate()
+            process.wait()
+    return {
+        "backend": "mongod" if args.mongod else "mongomock",
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "clients": args.clients,
+        "scale": args.scale,
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Workloads slower than the baseline by more than tolerance"""
+    regressions = []
+    for size, workloads in report["results"].items():
+        for name, current in workloads.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not isinstance(current, dict) or not before:
+                continue
+            if current["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{size} {name}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms")
+            if current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+                regressions.append(
+                    f"{size} {name}: {before['throughput_rps']} -> {current['throughput_rps']} req/s")
+            if current["errors"] > before["errors"]:
+                regressions.append(f"{size} {name}: {current['errors']} errors")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=DEFAULT_SIZES)
+    parser.add_argument("--workloads", type=lambda s: s.split(","), default=list(WORKLOADS))
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier on requests per workload")
+    parser.add_argument("--mongod", nargs="?", const=shutil.which("mongod") or "mongod", default=None,
+                        help="run against a temporary mongod (optionally the binary's path)")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="report to compare against")
+    parser.add_argument("--save-baseline", help="write this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    try:
+        report = asyncio.run(main_async(args))
+    finally:
+        shutil.rmtree(_scratch, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(text + "\n")
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        status = 1 if regressions else 0
+    if any(w["errors"] for r in report["results"].values() for w in r.values() if isinstance(w, dict)):
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
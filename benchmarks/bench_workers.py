@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Multi-worker scaling benchmark.
+
+Starts backend/server.py with WEB_CONCURRENCY=1, 2, 4, ... worker
+processes against one Mongo, drives it over HTTP with concurrent clients
+and reports throughput per worker count with the speedup over one
+worker. After each run a property is updated through one worker and
+fresh connections (spread over the workers by the kernel) poll it until
+every read shows the change: the cross-worker invalidation delay.
+
+Multiple workers need a real Mongo (the change feed tails a capped
+collection), so give a mongod binary or a URL:
+
+    python benchmarks/bench_workers.py --mongod --workers 1,2,4 --size 10000
+    python benchmarks/bench_workers.py --mongo-url mongodb://localhost:27017
+
+Scaling is bounded by the cores left after the load generator and
+mongod; on a machine with fewer cores than workers it cannot be linear.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench_concurrency import run_level
+from bench_suite import _scratch, free_port, property_docs, start_mongod
+
+SERVER = os.path.join(os.path.dirname(__file__), "..", "backend", "server.py")
+ENDPOINTS = ["/api/properties?view=card&limit=50", "/api/properties/p1", "/api/lots", "/api/search?q=villa"]
+
+
+def start_server(workers, mongo_url, db_name):
+    port = free_port()
+    env = dict(
+        os.environ, WEB_CONCURRENCY=str(workers), PORT=str(port), MONGO_URL=mongo_url, DB_NAME=db_name,
+        MEDIA_ROOT=os.path.join(_scratch, "media"),
+    )
+    process = subprocess.Popen([sys.executable, SERVER], env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/api/health", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def seed(url, size):
+    body = "\n".join(json.dumps(doc) for doc in property_docs(size)).encode()
+    async with httpx.AsyncClient(base_url=url, timeout=600) as http:
+        response = await http.post("/api/import", params={"collection": "properties"}, content=body)
+        response.raise_for_status()
+        return response.json()["imported"]
+
+
+async def propagation_ms(url, workers, stable_reads=None):
+    """Update p1 through one connection; time until fresh connections all see it"""
+    stable_reads = stable_reads or 10 * workers
+    async with httpx.AsyncClient(base_url=url, timeout=30) as http:
+        prop = (await http.get("/api/properties/p1")).json()
+        title = f"Bench {time.time_ns()}"
+        prop.pop("id")
+        start = time.perf_counter()
+        (await http.put("/api/properties/p1", json=dict(prop, ti=title))).raise_for_status()
+    fresh = httpx.Limits(max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=url, timeout=30, limits=fresh) as http:
+        streak = 0
+        while streak < stable_reads:
+            seen = (await http.get("/api/properties/p1")).json()["ti"]
+            streak = streak + 1 if seen == title else 0
+            if time.perf_counter() - start > 30:
+                return None
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+async def main_async(args, mongo_url):
+    db_name = f"bench_workers_{os.getpid()}"
+    process, url = start_server(1, mongo_url, db_name)
+    try:
+        imported = await seed(url, args.size)
+    finally:
+        stop_server(process)
+    print(f"   seeded {imported}", file=sys.stderr)
+
+    results = []
+    for workers in args.workers:
+        process, url = start_server(workers, mongo_url, db_name)
+        try:
+            await run_level(url, args.clients, min(2.0, args.duration), ENDPOINTS)  # warm caches
+            level = await run_level(url, args.clients, args.duration, ENDPOINTS)
+            level["workers"] = workers
+            level["propagation_ms"] = await propagation_ms(url, workers)
+        finally:
+            stop_server(process)
+        base = results[0]["throughput_rps"] if results else level["throughput_rps"]
+        level["speedup"] = round(level["throughput_rps"] / base, 2) if base else None
+        print(f"   {workers:>2} workers: {level['throughput_rps']:>8} req/s  x{level['speedup']}  "
+              f"p99 {level['p99_ms']}ms  propagation {level['propagation_ms']}ms  errors {level['errors']}",
+              file=sys.stderr)
+        results.append(level)
+    return {"cpus": os.cpu_count(), "size": args.size, "clients": args.clients, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4])
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--mongod", nargs="?", const=shutil.which("mongod") or "mongod",
+                       help="run against a temporary mongod (optionally the binary's path)")
+    group.add_argument("--mongo-url")
+    args = parser.parse_args()
+
+    mongod = None
+    try:
+        if args.mongod:
+            mongod, mongo_url = start_mongod(args.mongod)
+        else:
+            mongo_url = args.mongo_url
+        report = asyncio.run(main_async(args, mongo_url))
+    finally:
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+        shutil.rmtree(_scratch, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    return 1 if any(r["errors"] for r in report["results"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())